@@ -0,0 +1,244 @@
+"""Time the lookups of EmsEventsDB and AzEventsDB on synthetic events, with
+and without the indexes on cluster, node and the timing columns.
+
+Each database is filled with --events events without indexes, the lookups
+are timed, the indexes are created and the lookups are timed again. The
+results are logged and saved to the output dir as json.
+"""
+
+import datetime
+import json
+import logging
+import pathlib
+import random
+import tempfile
+import time
+
+from libs.config import Config
+from libs.log import setup_logger
+from libs.parseargs import argp
+from libs.sqlite.azevents_db import AzEventsDB
+from libs.sqlite.ems_db import EmsEventsDB
+
+script_name = pathlib.Path(__file__).stem
+
+setup_logger(script_name)
+
+START = datetime.datetime(2025, 1, 1)
+# the events are spread over a year
+SPAN_SECONDS = 365 * 86400
+# events generated and inserted at a time
+CHUNK_SIZE = 50000
+
+
+def make_events(rng: random.Random, start_index: int, count: int, clusters: int):
+    """Return count random events for EmsEventsDB and AzEventsDB."""
+    events = []
+    for index in range(start_index, start_index + count):
+        cluster = f"cluster{rng.randrange(clusters)}"
+        time_ = START + datetime.timedelta(seconds=rng.randrange(SPAN_SECONDS))
+        events.append(
+            {
+                "event_id": str(index),
+                "cluster": cluster,
+                "node": f"{cluster}-0{rng.randrange(1, 5)}",
+                "time": time_.isoformat(),
+                "event": "callhome.azure.maint",
+                "severity": "notice",
+                "message": "synthetic event",
+            }
+        )
+    return events
+
+
+def to_maintenance_event(event: dict) -> dict:
+    """Return a maintenance event with the timing columns around the time of event."""
+    time_ = datetime.datetime.fromisoformat(event["time"])
+    timings = {
+        column: (time_ + datetime.timedelta(minutes=5 * offset)).isoformat()
+        for offset, column in enumerate(AzEventsDB.TIMING_COLUMNS)
+    }
+    return {
+        "event_id": event["event_id"],
+        "cluster": event["cluster"],
+        "node": event["node"],
+        "type": "Freeze",
+        **timings,
+    }
+
+
+def drop_indexes(conn, table: str) -> None:
+    """Drop the indexes created on a table, not the ones of its primary key."""
+    cur = conn.execute(
+        'SELECT name FROM sqlite_master WHERE type="index" AND tbl_name=?'
+        " AND sql IS NOT NULL",
+        (table,),
+    )
+    for (name,) in cur.fetchall():
+        conn.execute(f'DROP INDEX "{name}"')
+
+
+def time_lookups(db, lookups: dict, queries: int) -> dict:
+    """Return name -> average seconds and rows of each lookup run queries times."""
+    results = {}
+    for name, (func, make_args) in lookups.items():
+        rng = random.Random(1)
+        rows = 0
+        start = time.perf_counter()
+        for _ in range(queries):
+            rows += len(func(*make_args(rng)))
+        results[name] = {
+            "seconds": (time.perf_counter() - start) / queries,
+            "rows": rows / queries,
+        }
+    results["full_scans"] = sorted(db.check_query_plans())
+    return results
+
+
+def benchmark_db(
+    db,
+    table: str,
+    insert,
+    lookups: dict,
+    events: int,
+    clusters: int,
+    queries: int,
+    convert=None,
+) -> dict:
+    """Fill a database without indexes, then time the lookups before and after indexing.
+
+    insert writes a list of events, converted by convert first if it is set,
+    lookups is name -> (function, function returning its arguments from a
+    random.Random).
+    """
+    drop_indexes(db.conn, table)
+    db.conn.commit()
+    rng = random.Random(0)
+    insert_seconds = 0.0
+    with db.bulk():
+        for start_index in range(0, events, CHUNK_SIZE):
+            chunk = make_events(
+                rng, start_index, min(CHUNK_SIZE, events - start_index), clusters
+            )
+            if convert is not None:
+                chunk = [convert(event) for event in chunk]
+            start = time.perf_counter()
+            insert(chunk)
+            insert_seconds += time.perf_counter() - start
+
+    results = {
+        "insert": {
+            "seconds": insert_seconds,
+            "rows_per_second": events / insert_seconds,
+        }
+    }
+    results["no_index"] = time_lookups(db, lookups, queries)
+    start = time.perf_counter()
+    db.create_indexes()
+    results["create_indexes"] = {"seconds": time.perf_counter() - start}
+    results["indexed"] = time_lookups(db, lookups, queries)
+    return results
+
+
+def random_node(clusters: int):
+    return lambda rng: (f"cluster{rng.randrange(clusters)}-0{rng.randrange(1, 5)}",)
+
+
+def random_hour(rng: random.Random) -> tuple:
+    start = START + datetime.timedelta(seconds=rng.randrange(SPAN_SECONDS))
+    return start.isoformat(), (start + datetime.timedelta(hours=1)).isoformat()
+
+
+if __name__ == "__main__":
+    args = argp(
+        script_name=script_name,
+        description=(
+            "time the EMS and maintenance event lookups with and without indexes"
+        ),
+        parse=False,
+    )
+    args.parser.add_argument(
+        "-n",
+        "--events",
+        type=int,
+        help="the number of synthetic events",
+        default=1_000_000,
+    )
+    args.parser.add_argument(
+        "--clusters",
+        type=int,
+        help="the number of clusters the events are spread over, 4 nodes each",
+        default=100,
+    )
+    args.parser.add_argument(
+        "-q",
+        "--queries",
+        type=int,
+        help="the number of times each lookup is run",
+        default=50,
+    )
+    args.parse()
+
+    config = Config(
+        args.config_dir,  # pyright: ignore[reportAttributeAccessIssue]
+        args.output_dir,  # pyright: ignore[reportAttributeAccessIssue]
+        script_name=script_name,
+        args=args,
+    )
+    events = args.events  # pyright: ignore[reportAttributeAccessIssue]
+    clusters = args.clusters  # pyright: ignore[reportAttributeAccessIssue]
+    queries = args.queries  # pyright: ignore[reportAttributeAccessIssue]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        ems_db = EmsEventsDB(config, db_name=pathlib.Path(tmp_dir) / "ems_events.db")
+        results["ems_events"] = benchmark_db(
+            ems_db,
+            "ems_events",
+            ems_db.insert_many,
+            {
+                "get_events_by_node": (
+                    ems_db.get_events_by_node,
+                    random_node(clusters),
+                ),
+                "get_events_between_datetimes": (
+                    ems_db.get_events_between_datetimes,
+                    random_hour,
+                ),
+            },
+            events,
+            clusters,
+            queries,
+        )
+        ems_db.conn.close()
+
+        az_db = AzEventsDB(config, db_name=pathlib.Path(tmp_dir) / "azevents.db")
+        results["maintenance_events"] = benchmark_db(
+            az_db,
+            "maintenance_events",
+            az_db.upsert_many,
+            {
+                "get_events_by_cluster": (
+                    az_db.get_events_by_cluster,
+                    lambda rng: (f"cluster{rng.randrange(clusters)}",),
+                ),
+                "get_events_by_node": (az_db.get_events_by_node, random_node(clusters)),
+                "get_events_between_datetimes": (
+                    az_db.get_events_between_datetimes,
+                    lambda rng: ("az_maint_started", *random_hour(rng)),
+                ),
+            },
+            events,
+            clusters,
+            queries,
+            convert=to_maintenance_event,
+        )
+        az_db.conn.close()
+
+    for table, table_results in results.items():
+        for test, result in table_results.items():
+            logging.info(f"{table} {test}: {result}")
+
+    output_file = config.output_dir / f"{script_name}.json"
+    output_file.write_text(json.dumps(results, indent=2))
+    logging.info(f"Results saved to {output_file}")
@@ -0,0 +1,162 @@
+"""Compare the per volume tables of MetricDB with the single metrics table of
+WideMetricDB, with and without the timestamp index, on synthetic data.
+
+Every database gets the same --volumes volumes with --points one minute points,
+written the way dump_cluster_metrics_dii writes them. Then it times:
+
+- insert: create_table and upsert_many for every volume
+- last_timestamp: get_last_timestamp of every volume, as in incremental mode
+- volume_range: the last 6 hours of --queries random volumes
+- all_volumes_range: one hour of every volume
+
+The results are logged and saved to the output dir as json.
+"""
+
+import json
+import logging
+import pathlib
+import random
+import tempfile
+import time
+
+from libs.config import Config
+from libs.log import setup_logger
+from libs.parseargs import argp
+from libs.sqlite.metrics_db import METRIC_COLUMNS, MetricDB, WideMetricDB
+
+script_name = pathlib.Path(__file__).stem
+
+setup_logger(script_name)
+
+CLUSTER = "benchmark"
+START = 1735689600  # 2025-01-01T00:00:00Z
+
+
+def make_records(rng: random.Random, points: int) -> list:
+    """Return points one minute records of random metrics."""
+    return [
+        {
+            "timestamp": START + index * 60,
+            **{metric: rng.random() * 1000 for metric in METRIC_COLUMNS},
+        }
+        for index in range(points)
+    ]
+
+
+def benchmark_db(metrics_db: MetricDB, volumes: int, points: int, queries: int) -> dict:
+    """Fill a database and time the queries the scripts make."""
+    keys = [
+        metrics_db.volume_key(CLUSTER, f"svm{index % 10}", f"vol{index}")
+        for index in range(volumes)
+    ]
+    rng = random.Random(0)
+    insert = 0.0
+    for key in keys:
+        records = make_records(rng, points)
+        start = time.perf_counter()
+        metrics_db.create_table(key)
+        metrics_db.upsert_many(key, records)
+        insert += time.perf_counter() - start
+
+    start = time.perf_counter()
+    for key in keys:
+        metrics_db.get_last_timestamp(key)
+    last_timestamp = time.perf_counter() - start
+
+    end = START + points * 60
+    start = time.perf_counter()
+    rows = 0
+    for key in random.Random(1).sample(keys, min(queries, len(keys))):
+        rows += len(metrics_db.get_rows(key, since=end - 6 * 3600))
+    volume_range = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if isinstance(metrics_db, WideMetricDB):
+        all_rows = len(metrics_db.get_rows_between(end - 3600, end))
+    else:
+        # every table has to be read
+        all_rows = 0
+        for table_name in metrics_db.get_volume_tables():
+            cur = metrics_db.conn.execute(
+                f'SELECT * FROM "{table_name}" WHERE CAST(timestamp AS INTEGER) >= ?'
+                " AND CAST(timestamp AS INTEGER) < ?",
+                (end - 3600, end),
+            )
+            all_rows += len(cur.fetchall())
+    all_volumes_range = time.perf_counter() - start
+
+    return {
+        "insert": {"seconds": insert, "rows_per_second": volumes * points / insert},
+        "last_timestamp": {"seconds": last_timestamp},
+        "volume_range": {"seconds": volume_range, "rows": rows},
+        "all_volumes_range": {"seconds": all_volumes_range, "rows": all_rows},
+        "bytes": pathlib.Path(metrics_db.db_location).stat().st_size,
+    }
+
+
+if __name__ == "__main__":
+    args = argp(
+        script_name=script_name,
+        description=(
+            "compare the insert and range query speed of the per volume and the"
+            " wide metrics databases"
+        ),
+        parse=False,
+    )
+    args.parser.add_argument(
+        "-v",
+        "--volumes",
+        type=int,
+        help="the number of volumes",
+        default=500,
+    )
+    args.parser.add_argument(
+        "-p",
+        "--points",
+        type=int,
+        help="the number of one minute points per volume, 3 days by default",
+        default=3 * 1440,
+    )
+    args.parser.add_argument(
+        "-q",
+        "--queries",
+        type=int,
+        help="the number of single volume range queries",
+        default=100,
+    )
+    args.parse()
+
+    config = Config(
+        args.config_dir,  # pyright: ignore[reportAttributeAccessIssue]
+        args.output_dir,  # pyright: ignore[reportAttributeAccessIssue]
+        script_name=script_name,
+        args=args,
+    )
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, metrics_db in (
+            ("tables", MetricDB(config, db_name=pathlib.Path(tmp_dir) / "tables.db")),
+            ("wide", WideMetricDB(config, db_name=pathlib.Path(tmp_dir) / "wide.db")),
+            (
+                "wide_timestamp_index",
+                WideMetricDB(
+                    config,
+                    db_name=pathlib.Path(tmp_dir) / "wide_timestamp_index.db",
+                    timestamp_index=True,
+                ),
+            ),
+        ):
+            results[name] = benchmark_db(
+                metrics_db,
+                args.volumes,  # pyright: ignore[reportAttributeAccessIssue]
+                args.points,  # pyright: ignore[reportAttributeAccessIssue]
+                args.queries,  # pyright: ignore[reportAttributeAccessIssue]
+            )
+            metrics_db.conn.close()
+            for test, result in results[name].items():
+                logging.info(f"{name} {test}: {result}")
+
+    output_file = config.output_dir / f"{script_name}.json"
+    output_file.write_text(json.dumps(results, indent=2))
+    logging.info(f"Results saved to {output_file}")
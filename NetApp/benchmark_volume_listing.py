@@ -0,0 +1,109 @@
+"""Compare the cost of listing the volumes of clusters with every field and
+with only the fields dump_cluster_metrics_dii uses.
+
+Each listing is repeated --runs times, the time and bytes received per
+listing are logged and saved to the output dir as json.
+"""
+
+import json
+import logging
+import pathlib
+import time
+import types
+
+from libs.api_metrics import APIMetrics
+from libs.config import Config
+from libs.log import setup_logger
+from libs.ontap.api import ONTAPAPIClient
+from libs.parseargs import argp
+
+script_name = pathlib.Path(__file__).stem
+
+setup_logger(script_name)
+
+FIELDS = ["*", "name,svm.name"]
+
+
+def benchmark_cluster(cluster, config, runs: int) -> dict:
+    """Time the volume listing of a cluster for each of FIELDS."""
+    results = {}
+    for fields in FIELDS:
+        metrics = APIMetrics()
+        client = ONTAPAPIClient(cluster, config, response_cache=None)
+        metrics.install(client)
+        times = []
+        count = 0
+        for _ in range(runs):
+            start = time.perf_counter()
+            count = sum(
+                1
+                for _ in client.iter_collection(
+                    "/storage/volumes",
+                    query_params={"is_svm_root": "false", "fields": fields},
+                )
+            )
+            times.append(time.perf_counter() - start)
+
+        received = sum(stats.bytes_received for stats in metrics.endpoints.values())
+        results[fields] = {
+            "volumes": count,
+            "seconds": min(times),
+            "bytes": received // runs,
+        }
+        logging.info(
+            f"{cluster.name} fields={fields}: {count} volumes,"
+            f" {min(times):.2f}s, {received // runs} bytes"
+        )
+
+    full, slim = results[FIELDS[0]], results[FIELDS[1]]
+    if slim["bytes"] and slim["seconds"]:
+        logging.info(
+            f"{cluster.name}: {full['bytes'] / slim['bytes']:.1f}x fewer bytes,"
+            f" {full['seconds'] / slim['seconds']:.1f}x faster"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    args = argp(
+        script_name=script_name,
+        description=(
+            "compare listing volumes with fields=* and with fields=name,svm.name"
+        ),
+        parse=False,
+    )
+    args.parser.add_argument(
+        "-n",
+        "--runs",
+        type=int,
+        help="the number of listings per cluster and fields",
+        default=3,
+    )
+    args.parse()
+
+    config = Config(
+        args.config_dir,  # pyright: ignore[reportAttributeAccessIssue]
+        args.output_dir,  # pyright: ignore[reportAttributeAccessIssue]
+        script_name=script_name,
+        args=args,
+    )
+
+    items = config.get_clusters(
+        args.filter  # pyright: ignore[reportAttributeAccessIssue]
+    )
+
+    all_results = {}
+    for name, details in items.items():
+        cluster = types.SimpleNamespace(**{**details, "name": name})
+        try:
+            all_results[name] = benchmark_cluster(
+                cluster,
+                config,
+                args.runs,  # pyright: ignore[reportAttributeAccessIssue]
+            )
+        except Exception as e:
+            logging.error(f"Could not benchmark cluster {name}", exc_info=e)
+
+    filename = config.output_dir / f"{script_name}.json"
+    filename.write_text(json.dumps(all_results, indent=2))
+    logging.info(f"Results saved to {filename}")
@@ -1,8 +1,12 @@
 import logging
 import pathlib
-import pprint
 import datetime
-import collections
+import json
+import os
+import time
+import functools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from zoneinfo import ZoneInfo
 
 from netapp_ontap import HostConnection  # pyright: ignore[reportPrivateImportUsage]
@@ -11,7 +15,11 @@ from netapp_ontap.resources import Volume
 from libs.config import Config
 from libs.parseargs import argp
 from libs.log import setup_logger
-from libs.sqlite.metrics_db import MetricDB
+from libs.sqlite.metrics_db import MetricDB, WideMetricDB
+from libs.sqlite.db_writer import DBWriter
+from libs.api_metrics import APIMetrics
+from libs.checkpoint import Checkpoint
+from libs.timeseries_table import FILL_POLICIES, TimeseriesTable, tables_by_tags
 import libs.dii
 
 script_name = pathlib.Path(__file__).stem
@@ -37,17 +45,39 @@ class AppClass:
         dt_end_date = tdate + datetime.timedelta(days=2)
         self.start_time = f"{dt_start_date:%Y-%m-%d}T{dt_start_date:%H:%M:%S}Z"
         self.end_time = f"{dt_end_date:%Y-%m-%d}T{dt_end_date:%H:%M:%S}Z"
+        self.start_epoch = int(dt_start_date.timestamp())
+        self.end_epoch = int(dt_end_date.timestamp())
         logging.info(f"Start time: {self.start_time}")
         logging.info(f"End time: {self.end_time}")
+        self.query_mode = getattr(self.config.args, "query_mode", "volume")
+        # only fetch the data newer than what is already in the database
+        self.incremental = getattr(self.config.args, "incremental", False)
+        self.fill_policy = getattr(self.config.args, "fill_policy", "none")
+        self.max_fill_points = getattr(self.config.args, "max_fill_points", 0)
+        self.cluster_workers = getattr(self.config.args, "cluster_workers", 4)
+        self.volume_workers = getattr(self.config.args, "volume_workers", 4)
+        # reuse the volume inventory of a previous run if younger than this
+        self.volume_cache_hours = getattr(self.config.args, "volume_cache_hours", 0)
+        # tables: one table per volume in a database per cluster,
+        # wide: every volume of every cluster in one table of one database
+        self.storage = getattr(self.config.args, "storage", "tables")
+        self.wide_metrics_db = None
+        # every database write goes through one thread
+        self.writer = DBWriter()
+        self.checkpoint = Checkpoint(
+            self.config.data_dir / f"{script_name}_{tdate:%Y-%m-%d}_checkpoint.json",
+            resume=getattr(self.config.args, "resume", False),
+        )
         # print(clusters)
         self.name = name
         self.cluster_details = clusters
         self.clusterdata = {}
-        self.dii_api_client = (
-            libs.dii.api.DIIAPIClient(  # pyright: ignore[reportAttributeAccessIssue]
-                self.config
-            )
+        # the async client queries the metrics of a volume concurrently
+        self.dii_api_client = libs.dii.api.AsyncDIIAPIClient(  # pyright: ignore[reportAttributeAccessIssue]
+            self.config
         )
+        self.api_metrics = APIMetrics()
+        self.api_metrics.install(self.dii_api_client)
 
         self.build_app()
 
@@ -57,9 +87,63 @@ class AppClass:
                 item, self, **self.cluster_details[item]
             )
 
+    def get_metrics_db(self, cluster_name: str) -> MetricDB:
+        """Return the database for the metrics of a cluster."""
+        if self.storage == "wide":
+            if self.wide_metrics_db is None:
+                self.wide_metrics_db = WideMetricDB(
+                    self.config,
+                    db_name=f"{self.config.args.date}_wide_metrics.db",  # pyright: ignore[reportOptionalMemberAccess]
+                    check_same_thread=False,
+                )
+            return self.wide_metrics_db
+        return MetricDB(
+            self.config,
+            db_name=f"{cluster_name}_{self.config.args.date}_metrics.db",  # pyright: ignore[reportOptionalMemberAccess]
+            check_same_thread=False,
+        )
+
     def gather_data(self):
-        for cluster in self.clusterdata.values():
-            cluster.gather_data()
+        # the volume listing of one cluster overlaps with the DII queries of another
+        with ThreadPoolExecutor(
+            max_workers=self.cluster_workers, thread_name_prefix="cluster"
+        ) as executor:
+            futures = {
+                executor.submit(cluster.gather_data): cluster
+                for cluster in self.clusterdata.values()
+            }
+        for future, cluster in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                cluster.add_error()
+                logging.error(
+                    f"Exception gathering data for {cluster.name}", exc_info=e
+                )
+        self.writer.close()
+        # everything was saved, the next run starts over
+        if not any(cluster.errors for cluster in self.clusterdata.values()):
+            self.checkpoint.remove()
+
+    def is_up_to_date(self, last_timestamp: int | None) -> bool:
+        """Check if the last saved timestamp is the last point of the window."""
+        return last_timestamp is not None and last_timestamp + 60 >= self.end_epoch
+
+    def get_start_epoch(self, last_timestamp: int | None) -> int:
+        """Return the start of the query, the last saved timestamp in incremental mode."""
+        if not self.incremental or last_timestamp is None:
+            return self.start_epoch
+        return max(last_timestamp, self.start_epoch)
+
+    def get_end_epoch(self) -> int:
+        """Return the end of the window, the current minute for a window not over yet."""
+        return min(self.end_epoch, int(time.time()) // 60 * 60)
+
+    def get_start_time(self, last_timestamp: int | None) -> str:
+        start = datetime.datetime.fromtimestamp(
+            self.get_start_epoch(last_timestamp), tz=ZoneInfo("GMT")
+        )
+        return f"{start:%Y-%m-%d}T{start:%H:%M:%S}Z"
 
 
 class ClusterData:
@@ -70,10 +154,10 @@ class ClusterData:
             setattr(self, name, value)
         self.app_instance = app_instance
         self.volume_metrics = {}
-        self.metrics_db = MetricDB(
-            self.app_instance.config,
-            db_name=f"{self.name}_{self.app_instance.config.args.date}_metrics.db",  # pyright: ignore[reportOptionalMemberAccess]
-        )
+        # counted from the cluster and volume workers and the writer thread
+        self.errors = 0
+        self.errors_lock = threading.Lock()
+        self.metrics_db = self.app_instance.get_metrics_db(self.name)
         self.metrics_to_get = [
             "read_ops",
             "write_ops",
@@ -83,33 +167,188 @@ class ClusterData:
             "write_latency",
         ]
 
+    def add_error(self):
+        """Count an error, the checkpoint is kept when a cluster has errors."""
+        with self.errors_lock:
+            self.errors += 1
+
+    def list_volumes(self) -> list:
+        """Return the non root volumes as {"name": ..., "svm": {"name": ...}}.
+
+        The inventory is saved to the data dir and reused while it is younger
+        than --volume_cache_hours.
+        """
+        cache_file = self.app_instance.config.data_dir / f"{self.name}_volumes.json"
+        max_age = self.app_instance.volume_cache_hours * 3600
+        if (
+            max_age
+            and cache_file.exists()
+            and time.time() - cache_file.stat().st_mtime < max_age
+        ):
+            logging.info(f"  Using the volume inventory in {cache_file}")
+            return json.loads(cache_file.read_text())
+
+        user, enc = self.app_instance.config.get_user("clusters", self.name)
+        connection = HostConnection(
+            self.ip,  # pyright: ignore[reportAttributeAccessIssue]
+            username=user,
+            password=enc,
+            verify=False,
+        )
+        volume_args = {}
+        volume_args["is_svm_root"] = False
+        # only the names are used, every field is a huge payload on big clusters
+        volume_args["fields"] = "name,svm.name"
+
+        # other clusters are listed at the same time from other threads, so the
+        # connection is passed instead of made the process wide current one
+        volumes = [
+            {"name": volume["name"], "svm": {"name": volume["svm"]["name"]}}
+            for volume in Volume.get_collection(connection=connection, **volume_args)
+        ]
+
+        tmp_file = cache_file.with_name(f"{cache_file.name}.tmp")
+        tmp_file.write_text(json.dumps(volumes))
+        os.replace(tmp_file, cache_file)
+        return volumes
+
     def gather_data(self):
         logging.info(f"Gathering data for cluster {self.name}")
-        user, enc = self.app_instance.config.get_user("clusters", self.name)
         try:
-            with HostConnection(
-                self.ip,  # pyright: ignore[reportAttributeAccessIssue]
-                username=user,
-                password=enc,
-                verify=False,
-            ):
-                volume_args = {}
-                volume_args["is_svm_root"] = False
-                volume_args["fields"] = "*"
-
-                volumes = list(Volume.get_collection(**volume_args))
-
-                for volume in volumes:
-                    self.gather_data_for_volume(volume["name"], volume["svm"]["name"])
+            volumes = self.list_volumes()
+
+            # skip the volumes finished by an interrupted run
+            volumes = [
+                volume
+                for volume in volumes
+                if not self.app_instance.checkpoint.is_done(
+                    self.checkpoint_key(volume["svm"]["name"], volume["name"])
+                )
+            ]
+
+            if self.app_instance.query_mode == "cluster":
+                self.gather_data_for_cluster(
+                    {(volume["svm"]["name"], volume["name"]) for volume in volumes}
+                )
+            else:
+                with ThreadPoolExecutor(
+                    max_workers=self.app_instance.volume_workers,
+                    thread_name_prefix=f"{self.name}-volume",
+                ) as executor:
+                    for volume in volumes:
+                        executor.submit(
+                            self.gather_data_for_volume,
+                            volume["name"],
+                            volume["svm"]["name"],
+                        )
         except Exception as e:
+            self.add_error()
             logging.error(f"Exception checking cluster {self.name}", exc_info=e)
 
+        # wait for the writes of this cluster
+        self.app_instance.writer.flush()
         logging.info(f"Database saved to {self.metrics_db.db_location}")
 
+    def checkpoint_key(self, vserver_name: str, volume_name: str) -> str:
+        return f"{self.name}:{vserver_name}:{volume_name}"
+
+    def get_last_timestamp(self, vserver_name: str, volume_name: str) -> int | None:
+        """Return the newest saved timestamp of a volume in incremental mode."""
+        if not self.app_instance.incremental:
+            return None
+        return self.app_instance.writer.call(
+            self.metrics_db.get_last_timestamp,
+            self.metrics_db.volume_key(self.name, vserver_name, volume_name),
+        )
+
+    def mark_done(self, vserver_name: str, volume_name: str):
+        """Record a finished volume, after the writes queued before it."""
+        self.app_instance.writer.submit(
+            self.app_instance.checkpoint.mark_done,
+            self.checkpoint_key(vserver_name, volume_name),
+        )
+
+    def gather_data_for_cluster(self, volumes: set):
+        """Query every volume of the cluster at once and split the series per volume.
+
+        volumes is a set of (vserver_name, volume_name), series for other
+        volumes (svm root volumes) are dropped.
+        """
+        if not volumes:
+            return
+        last_timestamps = [
+            self.get_last_timestamp(vserver_name, volume_name)
+            for vserver_name, volume_name in volumes
+        ]
+        # one query for every volume, so start at the volume furthest behind
+        last_timestamp = None
+        if None not in last_timestamps:
+            last_timestamp = min(ts for ts in last_timestamps if ts is not None)
+        if self.app_instance.is_up_to_date(last_timestamp):
+            logging.info(f"  All volumes of {self.name} are up to date")
+            return
+
+        logging.info(f"  Gathering data for all volumes of {self.name}")
+        try:
+            results = libs.dii.api.lake.query.timeseries.post(  # pyright: ignore[reportAttributeAccessIssue]
+                self.app_instance.dii_api_client,
+                category="netapp_ontap",
+                measurement="workload_volume",
+                metrics=self.metrics_to_get,
+                filter_expr=f'cluster_name = "{self.name}"',
+                interval="60s",
+                start_time=self.app_instance.get_start_time(last_timestamp),
+                end_time=self.app_instance.end_time,
+            )
+            # the query returns one series per tagSet, so demux them by volume
+            volume_tables = {
+                key: table
+                for key, table in tables_by_tags(
+                    results, ("vserver_name", "volume_name"), self.metrics_to_get
+                ).items()
+                if key in volumes
+            }
+        except Exception as e:
+            self.add_error()
+            logging.error(f"Could not retrieve data for {self.name}", exc_info=e)
+            return
+
+        for vserver_name, volume_name in sorted(volume_tables):
+            logging.info(f"  Saving data for {self.name}:{vserver_name}:{volume_name}")
+            try:
+                self.save_volume_metrics(
+                    volume_name,
+                    vserver_name,
+                    volume_tables[(vserver_name, volume_name)],
+                    self.app_instance.get_start_epoch(last_timestamp),
+                )
+            except Exception as e:
+                self.add_error()
+                logging.error(
+                    f"Could not save data for {self.name}:{vserver_name}:{volume_name}",
+                    exc_info=e,
+                )
+
+        # not checkpointed, nothing was saved and their data may still arrive
+        missing = volumes - volume_tables.keys()
+        if missing:
+            logging.warning(f"No data for {len(missing)} volumes of {self.name}")
+            for vserver_name, volume_name in sorted(missing):
+                logging.debug(f"  no data for {self.name}:{vserver_name}:{volume_name}")
+
     def gather_data_for_volume(self, volume_name: str, vserver_name: str):
-        logging.info(f"  Gathering data for {self.name}:{vserver_name}:{volume_name}")
-        bad_keys = []
         try:
+            last_timestamp = self.get_last_timestamp(vserver_name, volume_name)
+            if self.app_instance.is_up_to_date(last_timestamp):
+                logging.info(
+                    f"  {self.name}:{vserver_name}:{volume_name} is up to date"
+                )
+                self.mark_done(vserver_name, volume_name)
+                return
+
+            logging.info(
+                f"  Gathering data for {self.name}:{vserver_name}:{volume_name}"
+            )
             # Note : boolean operators must be CAPITAL LETTERS
             filter_expr = (
                 f'vserver_name = "{vserver_name}" AND volume_name = "{volume_name}"'
@@ -123,64 +362,87 @@ class ClusterData:
                 filter_expr=filter_expr,
                 interval="60s",
                 # lookback_minutes=1440
-                start_time=self.app_instance.start_time,
+                start_time=self.app_instance.get_start_time(last_timestamp),
                 end_time=self.app_instance.end_time,
             )
-            self.volume_metrics[volume_name] = collections.OrderedDict()
-            current_metrics = self.volume_metrics[volume_name]
-            first = True
-            for metric in results:
-                for data in results[metric][0]["timeseries"]:
-                    timestamp = data["time"] // 1000
-                    if timestamp not in current_metrics:
-                        if not first:
-                            logging.info(
-                                f"Got a new timestamp for metric {metric}"
-                                f' and time {data["time"]}'
-                            )
-                        current_metrics[timestamp] = {}
-                        current_metrics[timestamp]["timestamp"] = timestamp
-
-                    try:
-                        current_metrics[timestamp][metric] = data["value"]
-                    except KeyError:
-                        bad_keys.append(timestamp)
-                        logging.debug(
-                            f"bad timestamp data: {volume_name} {metric} {data}"
-                        )  # , exc_info=e)
-
-                first = False
-
-            # clean up any bad data
-            for item in bad_keys:
-                if (
-                    item in current_metrics
-                    and "timestamp" in current_metrics[item]
-                    and len(current_metrics[item]) == 1
-                ):
-                    del current_metrics[item]
-
-            # look for data with missing data points
-            number_of_metrics = len(self.metrics_to_get) + 1  # include timestamp key
-            for item in current_metrics:
-                if len(current_metrics[item]) != number_of_metrics:
-                    logging.error(
-                        f"timestamp {item} does not have {number_of_metrics} keys"
-                    )
-                    logging.error(pprint.pformat(current_metrics[item]))
-
-            # Add the data to database
-            table_name = f"{vserver_name}-{volume_name}"
-            self.metrics_db.create_table(table_name)
-            metrics_list = list(current_metrics.values())
-            self.metrics_db.upsert_many(table_name, metrics_list)
+            self.save_volume_metrics(
+                volume_name,
+                vserver_name,
+                TimeseriesTable.from_results(results, self.metrics_to_get),
+                self.app_instance.get_start_epoch(last_timestamp),
+            )
 
         except Exception as e:
+            self.add_error()
             logging.error(
                 f"Could not retrieve data for {self.name}:{vserver_name}:{volume_name}",
                 exc_info=e,
             )
 
+    def save_volume_metrics(
+        self,
+        volume_name: str,
+        vserver_name: str,
+        table: TimeseriesTable,
+        start_epoch: int,
+    ):
+        """Save the aligned metrics of a volume and a summary of its gaps.
+
+        start_epoch is the start of the query, every minute from there to the
+        end of the window, or to now for a recent date, should have a point.
+        """
+        # timestamps where no metric has a value are bad data
+        table = table.drop_empty_rows()
+        table = table.reindex(60, start_epoch, self.app_instance.get_end_epoch())
+        self.volume_metrics[volume_name] = table
+
+        # look for data with missing data points
+        gaps = table.find_gaps()
+        if gaps:
+            logging.warning(
+                f"{self.name}:{vserver_name}:{volume_name}: {len(gaps)} gaps with"
+                f" {sum(gap['count'] for gap in gaps)} missing points"
+            )
+        table = table.fill_gaps(
+            self.app_instance.fill_policy, self.app_instance.max_fill_points
+        ).drop_empty_rows()
+
+        # Add the data to database on the writer thread
+        future = self.app_instance.writer.submit(
+            self.write_volume_metrics,
+            self.metrics_db.volume_key(self.name, vserver_name, volume_name),
+            table.to_records(),
+            gaps,
+            start_epoch,
+            self.checkpoint_key(vserver_name, volume_name),
+        )
+        future.add_done_callback(
+            functools.partial(
+                self.check_write, f"{self.name}:{vserver_name}:{volume_name}"
+            )
+        )
+
+    def write_volume_metrics(
+        self,
+        key,
+        records: list,
+        gaps: list,
+        start_epoch: int,
+        checkpoint_key: str,
+    ):
+        """Write the rows and gaps of a volume, runs on the writer thread."""
+        self.metrics_db.create_table(key)
+        if records:
+            self.metrics_db.upsert_many(key, records)
+        self.metrics_db.save_gaps(key, gaps, since=start_epoch)
+        self.app_instance.checkpoint.mark_done(checkpoint_key)
+
+    def check_write(self, name: str, future: Future):
+        error = future.exception()
+        if error is not None:
+            self.add_error()
+            logging.error(f"Could not save data for {name}", exc_info=error)
+
 
 if __name__ == "__main__":
 
@@ -199,6 +461,77 @@ if __name__ == "__main__":
         default="",
         required=True,
     )
+    args.parser.add_argument(
+        "-q",
+        "--query_mode",
+        type=str,
+        choices=["volume", "cluster"],
+        help=(
+            "volume: query the metrics of each volume separately,"
+            " cluster: query the whole cluster once and split the results by volume"
+        ),
+        default="volume",
+    )
+    args.parser.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        help="only fetch the data newer than the last timestamp already saved",
+    )
+    args.parser.add_argument(
+        "-r",
+        "--resume",
+        action="store_true",
+        help="skip the volumes finished by an interrupted run of the same date",
+    )
+    args.parser.add_argument(
+        "--fill_policy",
+        type=str,
+        choices=FILL_POLICIES,
+        help=(
+            "how to fill the gaps between two points before saving, the gaps"
+            " are listed in the metric_gaps table either way"
+        ),
+        default="none",
+    )
+    args.parser.add_argument(
+        "--max_fill_points",
+        type=int,
+        help="only fill gaps of at most this many points, 0 fills every gap",
+        default=0,
+    )
+    args.parser.add_argument(
+        "--cluster_workers",
+        type=int,
+        help="the number of clusters gathered at the same time",
+        default=4,
+    )
+    args.parser.add_argument(
+        "--volume_workers",
+        type=int,
+        help="the number of volumes of a cluster queried at the same time",
+        default=4,
+    )
+    args.parser.add_argument(
+        "--volume_cache_hours",
+        type=float,
+        help=(
+            "reuse the volume inventory saved by a previous run if it is younger"
+            " than this, 0 always lists the volumes"
+        ),
+        default=0,
+    )
+    args.parser.add_argument(
+        "--storage",
+        type=str,
+        choices=["tables", "wide"],
+        help=(
+            "tables: a table per volume in a {cluster}_{date}_metrics.db per cluster,"
+            " wide: one metrics table keyed by cluster, svm, volume and timestamp"
+            " in {date}_wide_metrics.db"
+        ),
+        default="tables",
+    )
     args.parse()
 
     config = Config(
@@ -214,6 +547,7 @@ if __name__ == "__main__":
 
     APP = AppClass("Provisioned", items, config)
     APP.gather_data()
+    APP.api_metrics.save(config.output_dir / f"{script_name}_api_metrics")
 
     # print("------------------- get_schema_for_endpoint -----------------------------")
     # pprint.pprint(client.get_schema_for_endpoint("/lake/query/timeseries", "post"))
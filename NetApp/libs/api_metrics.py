@@ -0,0 +1,226 @@
+"""Collect per endpoint request metrics from APIWrapper hooks.
+
+metrics = APIMetrics()
+metrics.install(client)
+... make calls, the same APIMetrics can be installed on several clients ...
+metrics.save(config.output_dir / "api_metrics")
+
+Writes api_metrics.json and api_metrics.prom (Prometheus text format).
+"""
+
+import json
+import logging
+import pathlib
+import threading
+from typing import Any, Dict, Tuple
+from urllib.parse import urlsplit
+
+# upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class EndpointStats:
+    """Latency histogram and counters for one host/method/path."""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        """Initialize the class.
+
+        :param buckets: upper bounds of the latency buckets in seconds
+        :type buckets: Tuple[float, ...]
+        """
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.latency_sum = 0.0
+        self.latency_min = None
+        self.latency_max = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.statuses: Dict[int, int] = {}
+        self.validation_time = 0.0
+
+    def observe_latency(self, elapsed: float) -> None:
+        """Add a request latency to the histogram."""
+        self.latency_sum += elapsed
+        self.latency_max = max(self.latency_max, elapsed)
+        if self.latency_min is None or elapsed < self.latency_min:
+            self.latency_min = elapsed
+        for index, bound in enumerate(self.buckets):
+            if elapsed <= bound:
+                self.bucket_counts[index] += 1
+                return
+        self.bucket_counts[-1] += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the stats as a json serializable dict."""
+        timed = self.count + self.errors
+        return {
+            "requests": self.count,
+            "errors": self.errors,
+            "retries": self.retries,
+            "statuses": {str(status): n for status, n in self.statuses.items()},
+            "latency": {
+                "sum": self.latency_sum,
+                "min": self.latency_min,
+                "max": self.latency_max,
+                "avg": self.latency_sum / timed if timed else None,
+                "buckets": {
+                    **{str(b): n for b, n in zip(self.buckets, self.bucket_counts)},
+                    "+Inf": self.bucket_counts[-1],
+                },
+            },
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "validation_time": self.validation_time,
+        }
+
+
+class APIMetrics:
+    """Per endpoint latency histograms, bytes, status codes and validation time.
+
+    Stats are keyed by (host, method, path template) so slow endpoints and
+    slow clusters both stand out.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        """Initialize the class.
+
+        :param buckets: upper bounds of the latency buckets in seconds
+        :type buckets: Tuple[float, ...]
+        """
+        self.buckets = tuple(sorted(buckets))
+        self.endpoints: Dict[Tuple[str, str, str], EndpointStats] = {}
+        # hooks run on the worker threads of AsyncAPIWrapper
+        self.lock = threading.Lock()
+
+    def install(self, client) -> None:
+        """Add the hooks to an APIWrapper.
+
+        :param client: the APIWrapper to collect metrics for
+        """
+        client.add_hook("pre_request", self.on_pre_request)
+        client.add_hook("post_response", self.on_post_response)
+        client.add_hook("error", self.on_error)
+
+    def _get_stats(self, info: Dict[str, Any]) -> EndpointStats:
+        """Return the stats for the endpoint of a hook call, lock must be held."""
+        key = (
+            urlsplit(info["url"]).netloc,
+            info["method"],
+            info.get("path_template") or urlsplit(info["url"]).path,
+        )
+        stats = self.endpoints.get(key)
+        if stats is None:
+            stats = self.endpoints[key] = EndpointStats(self.buckets)
+        return stats
+
+    def on_pre_request(self, info: Dict[str, Any]) -> None:
+        """Hook for pre_request, counts retries and validation time."""
+        with self.lock:
+            stats = self._get_stats(info)
+            if info["attempt"]:
+                stats.retries += 1
+            else:
+                stats.validation_time += info.get("validation_time", 0.0)
+
+    def on_post_response(self, info: Dict[str, Any]) -> None:
+        """Hook for post_response."""
+        with self.lock:
+            stats = self._get_stats(info)
+            stats.count += 1
+            stats.observe_latency(info["elapsed"])
+            stats.statuses[info["status"]] = stats.statuses.get(info["status"], 0) + 1
+            stats.bytes_sent += info.get("bytes_sent", 0)
+            stats.bytes_received += info.get("bytes_received", 0)
+
+    def on_error(self, info: Dict[str, Any]) -> None:
+        """Hook for error."""
+        with self.lock:
+            stats = self._get_stats(info)
+            stats.errors += 1
+            stats.observe_latency(info["elapsed"])
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the stats grouped by host, then "METHOD path"."""
+        data: Dict[str, Any] = {}
+        with self.lock:
+            for (host, method, path), stats in sorted(self.endpoints.items()):
+                data.setdefault(host, {})[f"{method} {path}"] = stats.to_dict()
+        return data
+
+    def to_json(self) -> str:
+        """Return the stats as json."""
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self, prefix: str = "apiwrapper") -> str:
+        """Return the stats in the Prometheus text exposition format.
+
+        :param prefix: the prefix of the metric names
+        :type prefix: str
+        """
+        duration = f"{prefix}_request_duration_seconds"
+        families: Dict[str, list] = {
+            f"{duration} histogram": [],
+            f"{prefix}_requests_total counter": [],
+            f"{prefix}_errors_total counter": [],
+            f"{prefix}_retries_total counter": [],
+            f"{prefix}_bytes_sent_total counter": [],
+            f"{prefix}_bytes_received_total counter": [],
+            f"{prefix}_validation_seconds_total counter": [],
+        }
+        samples = list(families.values())
+        with self.lock:
+            for (host, method, path), stats in sorted(self.endpoints.items()):
+                labels = (
+                    f'host="{_escape(host)}",method="{method}",path="{_escape(path)}"'
+                )
+                cumulative = 0
+                for bound, count in zip(stats.buckets, stats.bucket_counts):
+                    cumulative += count
+                    samples[0].append(
+                        f'{duration}_bucket{{{labels},le="{bound}"}} {cumulative}'
+                    )
+                cumulative += stats.bucket_counts[-1]
+                samples[0].append(
+                    f'{duration}_bucket{{{labels},le="+Inf"}} {cumulative}'
+                )
+                samples[0].append(f"{duration}_sum{{{labels}}} {stats.latency_sum}")
+                samples[0].append(f"{duration}_count{{{labels}}} {cumulative}")
+                for status, count in sorted(stats.statuses.items()):
+                    samples[1].append(
+                        f'{prefix}_requests_total{{{labels},status="{status}"}} {count}'
+                    )
+                for index, name, value in (
+                    (2, "errors_total", stats.errors),
+                    (3, "retries_total", stats.retries),
+                    (4, "bytes_sent_total", stats.bytes_sent),
+                    (5, "bytes_received_total", stats.bytes_received),
+                    (6, "validation_seconds_total", stats.validation_time),
+                ):
+                    samples[index].append(f"{prefix}_{name}{{{labels}}} {value}")
+
+        lines = []
+        for family, family_samples in families.items():
+            lines.append(f"# TYPE {family}")
+            lines.extend(family_samples)
+        return "\n".join(lines) + "\n"
+
+    def save(self, base_name: pathlib.Path) -> None:
+        """Write the stats to base_name.json and base_name.prom.
+
+        :param base_name: the file name without the suffix
+        :type base_name: pathlib.Path
+        """
+        base_name = pathlib.Path(base_name)
+        json_file = base_name.with_name(f"{base_name.name}.json")
+        prom_file = base_name.with_name(f"{base_name.name}.prom")
+        json_file.write_text(self.to_json(), encoding="utf-8")
+        prom_file.write_text(self.to_prometheus(), encoding="utf-8")
+        logging.info(f"API metrics saved to {json_file} and {prom_file}")
+
+
+def _escape(value: str) -> str:
+    """Escape a Prometheus label value."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
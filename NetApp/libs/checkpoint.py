@@ -0,0 +1,93 @@
+"""Record the items a long run has finished so an interrupted run can resume.
+
+checkpoint = Checkpoint(config.data_dir / "run_checkpoint.json")
+for item in items:
+    if checkpoint.is_done(item):
+        continue
+    ... process item ...
+    checkpoint.mark_done(item)
+checkpoint.remove()  # the run completed
+"""
+
+import json
+import logging
+import os
+import pathlib
+import threading
+
+
+class Checkpoint:
+    """A log with the json encoded key of a finished item per line.
+
+    mark_done appends one line, the log is compacted when it is loaded.
+    """
+
+    def __init__(self, path: pathlib.Path, resume: bool = True):
+        """Initialize the class.
+
+        :param path: the checkpoint file
+        :type path: pathlib.Path
+        :param resume: load the items finished by a previous run, otherwise
+            start over
+        :type resume: bool
+        """
+        self.path = pathlib.Path(path)
+        self.done: set = set()
+        self.lock = threading.RLock()
+        if not resume:
+            self.remove()
+        elif self.path.exists():
+            try:
+                self.done = self.load()
+                logging.info(
+                    f"Resuming from {self.path}, {len(self.done)} items already done"
+                )
+            except (OSError, UnicodeDecodeError) as e:
+                logging.warning(f"Ignoring unreadable checkpoint {self.path}: {e}")
+            self.save()
+
+    def load(self) -> set:
+        """Read the keys in the log, a line cut by a crash is skipped."""
+        done = set()
+        with self.path.open(encoding="utf-8") as log:
+            for line in log:
+                try:
+                    key = json.loads(line)
+                except ValueError:
+                    logging.warning(f"Skipping a partial line of {self.path}")
+                    continue
+                if isinstance(key, dict):
+                    # the {"done": [...]} file of older versions
+                    done.update(key.get("done", []))
+                else:
+                    done.add(key)
+        return done
+
+    def is_done(self, key: str) -> bool:
+        """Check if an item was finished."""
+        return key in self.done
+
+    def mark_done(self, key: str) -> None:
+        """Record a finished item and append it to the log."""
+        with self.lock:
+            if key in self.done:
+                return
+            self.done.add(key)
+            with self.path.open("a", encoding="utf-8") as log:
+                log.write(f"{json.dumps(key)}\n")
+
+    def save(self) -> None:
+        """Compact the log, a partial write never replaces a good file."""
+        with self.lock:
+            tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+            tmp_path.write_text(
+                "".join(f"{json.dumps(key)}\n" for key in sorted(self.done)),
+                encoding="utf-8",
+            )
+            os.replace(tmp_path, self.path)
+
+    def remove(self) -> None:
+        """Delete the checkpoint once the run completed."""
+        with self.lock:
+            self.done = set()
+            self.path.unlink(missing_ok=True)
@@ -2,7 +2,7 @@
 from pathlib import Path
 
 from libs.import_utils import import_all_files
-from libs.openapi import APIWrapper
+from libs.openapi import APIWrapper, AsyncAPIWrapper
 
 package_name = __name__
 package_path = Path(__file__).parent
@@ -13,6 +13,14 @@ import_all_files(package_name=package_name, package_path=package_path)
 class DIIAPIClient(APIWrapper):
     def __init__(self, config, **kwargs):
         self.config = config
+        kwargs.setdefault("spec_cache_dir", config.data_dir / "spec_cache")
+        kwargs.setdefault(
+            "connection_settings", config.settings["diiapi"].get("connection", {})
+        )
+        kwargs.setdefault("retry_settings", config.settings["diiapi"].get("retry", {}))
+        kwargs.setdefault(
+            "rate_limit_settings", config.settings["diiapi"].get("rate_limit", {})
+        )
 
         super().__init__(
             api_json_file=config.get_schema_location("dii") / "all.json",
@@ -25,3 +33,7 @@ class DIIAPIClient(APIWrapper):
             base_api_path=self.config.settings["diiapi"]["general"]["base_api_path"],
             **kwargs,
         )
+
+
+class AsyncDIIAPIClient(DIIAPIClient, AsyncAPIWrapper):
+    """DIIAPIClient with concurrent calls, see AsyncAPIWrapper."""
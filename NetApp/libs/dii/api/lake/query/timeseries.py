@@ -1,8 +1,41 @@
 import logging
+import re
 from datetime import datetime, timedelta, timezone
 
 from libs.time_utils import to_epoch_ms
 
+# the most data points asked for in one query, longer ranges are split into
+# windows of this many intervals
+MAX_POINTS_PER_QUERY = 1440
+
+INTERVAL_UNITS_MS = {"ms": 1, "s": 1000, "m": 60000, "h": 3600000, "d": 86400000}
+
+
+def interval_to_ms(interval: str) -> int:
+    """Convert an aggregation interval like "60s", "5m" or "1h" to milliseconds."""
+    match = re.fullmatch(r"\s*(\d+)\s*(ms|s|m|h|d)\s*", interval)
+    if not match:
+        raise ValueError(f"Invalid interval: {interval}")
+    return int(match.group(1)) * INTERVAL_UNITS_MS[match.group(2)]
+
+
+def split_time_range(
+    start_ms: int, end_ms: int, interval_ms: int, max_points: int
+) -> list:
+    """Split [start_ms, end_ms] into windows of at most max_points intervals.
+
+    Returns a list of (from_ms, to_ms, points), the windows share their edges.
+    """
+    window_ms = interval_ms * max(max_points, 1)
+    windows = []
+    window_start = start_ms
+    while window_start < end_ms:
+        window_end = min(window_start + window_ms, end_ms)
+        points = max(-(-(window_end - window_start) // interval_ms), 1)
+        windows.append((window_start, window_end, points))
+        window_start = window_end
+    return windows or [(start_ms, end_ms, 1)]
+
 
 def post(
     client,
@@ -14,7 +47,19 @@ def post(
     start_time: str | None = None,
     end_time: str | None = None,
     lookback_minutes: int | None = None,
+    batched: bool = True,
+    max_points_per_query: int = MAX_POINTS_PER_QUERY,
 ) -> dict:
+    """Query the timeseries of several metrics of a measurement.
+
+    Ranges longer than max_points_per_query intervals are split into windows
+    that are stitched back together, so each response stays bounded.
+
+    With batched set and a client that has call_many (AsyncDIIAPIClient) the
+    metrics and windows are queried concurrently, otherwise one after the other.
+
+    Returns a dict of metric -> list of series, None if the query failed.
+    """
     if start_time and end_time:
         # Expecting ISO 8601 format: "YYYY-MM-DDTHH:MM:SSZ"
         start = datetime.fromisoformat(start_time.replace("Z", "+00:00"))
@@ -29,34 +74,104 @@ def post(
 
     start_ms = to_epoch_ms(start)  # pyright: ignore[reportArgumentType]
     end_ms = to_epoch_ms(end)  # pyright: ignore[reportArgumentType]
-    max_points = int((end_ms - start_ms) / 60000)  # 1 point per minute
+    windows = split_time_range(
+        start_ms, end_ms, interval_to_ms(interval), max_points_per_query
+    )
+    if len(windows) > 1:
+        logging.debug(
+            f"splitting {category}:{measurement} into {len(windows)} windows"
+            f" of up to {max_points_per_query} points"
+        )
+
+    queries = [
+        (
+            metric,
+            {
+                "category": category,
+                "measurement": measurement,
+                "metric": metric,
+                "filter": filter_expr,
+                "fromTimeMs": from_ms,
+                "toTimeMs": to_ms,
+                "timeAggregationInterval": interval,
+                "maxNumberOfDataPoints": points,
+                "detectAnomalies": False,
+                "interpolationType": "NONE",
+            },
+        )
+        for metric in metrics
+        for from_ms, to_ms, points in windows
+    ]
+
+    # the endpoint takes a single metric, so a batch is one request per metric
+    # and window made concurrently when the client supports it
+    if batched and len(queries) > 1 and hasattr(client, "call_many"):
+        responses = client.call_many(
+            [
+                {
+                    "path_template": "/lake/query/timeseries",
+                    "method": "POST",
+                    "body": payload,
+                    "idempotent": True,
+                }
+                for _, payload in queries
+            ],
+            return_exceptions=True,
+        )
+    else:
+        responses = [_query(client, payload) for _, payload in queries]
+
+    window_responses = {metric: [] for metric in metrics}
+    for (metric, _), response in zip(queries, responses):
+        window_responses[metric].append(response)
 
     results = {}
-    for metric in metrics:
-        payload = {
-            "category": category,
-            "measurement": measurement,
-            "metric": metric,
-            "filter": filter_expr,
-            "fromTimeMs": start_ms,
-            "toTimeMs": end_ms,
-            "timeAggregationInterval": interval,
-            "maxNumberOfDataPoints": max_points,
-            "detectAnomalies": False,
-            "interpolationType": "NONE",
-        }
-
-        try:
-            response = client.call_endpoint(
-                "/lake/query/timeseries", method="POST", body=payload
-            )
-            if not response:
-                logging.debug(
-                    f"no data for {category}:{measurement}:{metric} with {filter_expr}"
-                )
-            results[metric] = response
-        except Exception as e:
-            logging.error(f"Error querying metric {metric}: {e}")
+    for metric, responses in window_responses.items():
+        errors = [response for response in responses if isinstance(response, Exception)]
+        if errors:
+            logging.error(f"Error querying metric {metric}: {errors[0]}")
             results[metric] = None
+            continue
+        response = _stitch(responses)
+        if not response:
+            logging.debug(
+                f"no data for {category}:{measurement}:{metric} with {filter_expr}"
+            )
+        results[metric] = response
 
     return results
+
+
+def _query(client, payload: dict):
+    """Query one metric, returning the exception instead of raising it."""
+    try:
+        # the query only reads data, so it is safe to retry
+        return client.call_endpoint(
+            "/lake/query/timeseries", method="POST", body=payload, idempotent=True
+        )
+    except Exception as e:
+        return e
+
+
+def _stitch(responses: list):
+    """Join the series of consecutive windows by tagSet.
+
+    The windows share their edges, so a point on an edge is only kept once.
+    """
+    if len(responses) == 1:
+        return responses[0]
+
+    series_by_tags = {}
+    seen_times = {}
+    for response in responses:
+        for series in response or []:
+            key = tuple(sorted(series.get("tagSet", {}).items()))
+            if key not in series_by_tags:
+                series_by_tags[key] = {**series, "timeseries": []}
+                seen_times[key] = set()
+            for data in series.get("timeseries", []):
+                if data.get("time") not in seen_times[key]:
+                    seen_times[key].add(data.get("time"))
+                    series_by_tags[key]["timeseries"].append(data)
+
+    return list(series_by_tags.values())
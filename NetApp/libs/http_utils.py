@@ -0,0 +1,365 @@
+"""Helpers for the requests sessions used by the API clients.
+
+The connection settings can be set in the [connection] section of the api
+toml (diiapi.toml, ontapapi.toml):
+
+[connection]
+pool_connections = 10   # number of host pools to keep
+pool_maxsize = 32       # connections kept alive per host
+pool_block = false      # wait for a free connection instead of opening more
+keepalive = true        # enable TCP keepalive on the sockets
+keepalive_idle = 60     # seconds idle before the first keepalive probe
+keepalive_interval = 15 # seconds between probes
+keepalive_count = 4     # failed probes before the connection is dropped
+
+Retries and client side rate limiting are set in the [retry] and [rate_limit]
+sections:
+
+[retry]
+total = 5               # retries after the first attempt, 0 disables retries
+backoff_factor = 0.5    # the backoff before retry n is up to factor * 2**n
+backoff_max = 60        # cap on the backoff and on Retry-After
+statuses = [429, 500, 502, 503, 504]
+methods = ["GET", "HEAD", "OPTIONS", "PUT", "DELETE"]  # idempotent methods
+
+[rate_limit]
+requests_per_second = 20  # 0 disables the limiter
+burst = 20                # requests that can be made at once after idling
+"""
+
+import email.utils
+import logging
+import random
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+# the server rejected these before doing any work, so any method can be retried
+REJECTED_STATUSES = (429, 503)
+
+DEFAULT_CONNECTION_SETTINGS: Dict[str, Any] = {
+    "pool_connections": 10,
+    "pool_maxsize": 10,
+    "pool_block": False,
+    "keepalive": True,
+    "keepalive_idle": 60,
+    "keepalive_interval": 15,
+    "keepalive_count": 4,
+}
+
+
+class KeepAliveHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that passes socket options to the connection pools."""
+
+    __attrs__ = HTTPAdapter.__attrs__ + ["socket_options"]
+
+    def __init__(
+        self, socket_options: Optional[List[Tuple[int, int, int]]] = None, **kwargs
+    ):
+        """Initialize the class.
+
+        :param socket_options: socket options for every new connection
+        :type socket_options: Optional[List[Tuple[int, int, int]]]
+        """
+        self.socket_options = socket_options
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        """Create the pool manager with the socket options."""
+        if self.socket_options is not None:
+            kwargs["socket_options"] = self.socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+
+def build_socket_options(settings: Dict[str, Any]) -> List[Tuple[int, int, int]]:
+    """Build the socket options for the keepalive settings.
+
+    :param settings: the connection settings
+    :type settings: Dict[str, Any]
+    :return: the socket options, urllib3 defaults included
+    :rtype: List[Tuple[int, int, int]]
+    """
+    options = list(HTTPConnection.default_socket_options)
+    if not settings.get("keepalive"):
+        return options
+
+    options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+    # not every platform has the fine grained keepalive options
+    for name, key in (
+        ("TCP_KEEPIDLE", "keepalive_idle"),
+        ("TCP_KEEPINTVL", "keepalive_interval"),
+        ("TCP_KEEPCNT", "keepalive_count"),
+    ):
+        if hasattr(socket, name) and settings.get(key):
+            options.append((socket.IPPROTO_TCP, getattr(socket, name), settings[key]))
+    return options
+
+
+def configure_session(
+    session: requests.Session, connection_settings: Optional[Dict[str, Any]] = None
+) -> KeepAliveHTTPAdapter:
+    """Mount a pooled keepalive adapter on a session.
+
+    :param session: the session to configure
+    :type session: requests.Session
+    :param connection_settings: overrides for DEFAULT_CONNECTION_SETTINGS
+    :type connection_settings: Optional[Dict[str, Any]]
+    :return: the mounted adapter
+    :rtype: KeepAliveHTTPAdapter
+    """
+    settings = {**DEFAULT_CONNECTION_SETTINGS, **(connection_settings or {})}
+    logging.debug(f"configure_session: {settings}")
+
+    adapter = KeepAliveHTTPAdapter(
+        socket_options=build_socket_options(settings),
+        pool_connections=settings["pool_connections"],
+        pool_maxsize=settings["pool_maxsize"],
+        pool_block=settings["pool_block"],
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return adapter
+
+
+def connection_stats(session: requests.Session) -> Dict[str, Any]:
+    """Return connection reuse stats for the pools of a session.
+
+    Stats for a host are lost when its pool is evicted, which only happens
+    with more hosts than pool_connections.
+
+    :param session: the session to inspect
+    :type session: requests.Session
+    :return: totals and per host counts of requests and new connections
+    :rtype: Dict[str, Any]
+    """
+    hosts: Dict[str, Dict[str, int]] = {}
+    for adapter in set(session.adapters.values()):
+        managers = [getattr(adapter, "poolmanager", None)]
+        managers.extend(getattr(adapter, "proxy_manager", {}).values())
+        for manager in managers:
+            if manager is None:
+                continue
+            for key in manager.pools.keys():
+                pool = manager.pools.get(key)
+                if pool is None:
+                    continue
+                host = f"{pool.scheme}://{pool.host}:{pool.port}"
+                counts = hosts.setdefault(host, {"requests": 0, "new_connections": 0})
+                counts["requests"] += pool.num_requests
+                counts["new_connections"] += pool.num_connections
+
+    total_requests = sum(item["requests"] for item in hosts.values())
+    total_connections = sum(item["new_connections"] for item in hosts.values())
+    reused = max(total_requests - total_connections, 0)
+    return {
+        "requests": total_requests,
+        "new_connections": total_connections,
+        "reused": reused,
+        "reuse_ratio": reused / total_requests if total_requests else 0.0,
+        "hosts": hosts,
+    }
+
+
+class RetryPolicy:
+    """Decide if and when a failed request is retried.
+
+    Idempotent methods are retried on the retry statuses and on connection
+    errors. Other methods are only retried when the server rejected the
+    request (429/503) or the connection was never made.
+    """
+
+    def __init__(
+        self,
+        total: int = 5,
+        backoff_factor: float = 0.5,
+        backoff_max: float = 60.0,
+        statuses: Iterable[int] = (429, 500, 502, 503, 504),
+        methods: Iterable[str] = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE"),
+    ):
+        """Initialize the class.
+
+        :param total: the number of retries after the first attempt
+        :type total: int
+        :param backoff_factor: the backoff before retry n is up to factor * 2**n
+        :type backoff_factor: float
+        :param backoff_max: cap on the backoff and on Retry-After
+        :type backoff_max: float
+        :param statuses: the HTTP statuses to retry
+        :type statuses: Iterable[int]
+        :param methods: the idempotent methods
+        :type methods: Iterable[str]
+        """
+        self.total = total
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.statuses = set(statuses)
+        self.methods = {method.upper() for method in methods}
+
+    def is_idempotent(self, method: str, idempotent: Optional[bool] = None) -> bool:
+        """Check if a method can be safely repeated.
+
+        :param method: the HTTP method
+        :type method: str
+        :param idempotent: override for a call, like a POST that only queries
+        :type idempotent: Optional[bool]
+        """
+        if idempotent is not None:
+            return idempotent
+        return method.upper() in self.methods
+
+    def should_retry_status(
+        self, method: str, status: int, attempt: int, idempotent: Optional[bool] = None
+    ) -> bool:
+        """Check if a response with status should be retried.
+
+        :param method: the HTTP method
+        :type method: str
+        :param status: the HTTP status of the response
+        :type status: int
+        :param attempt: the number of retries done so far
+        :type attempt: int
+        :param idempotent: override for a call, like a POST that only queries
+        :type idempotent: Optional[bool]
+        """
+        if attempt >= self.total or status not in self.statuses:
+            return False
+        return self.is_idempotent(method, idempotent) or status in REJECTED_STATUSES
+
+    def should_retry_exception(
+        self,
+        method: str,
+        exc: Exception,
+        attempt: int,
+        idempotent: Optional[bool] = None,
+    ) -> bool:
+        """Check if a request that raised exc should be retried.
+
+        :param method: the HTTP method
+        :type method: str
+        :param exc: the exception raised by requests
+        :type exc: Exception
+        :param attempt: the number of retries done so far
+        :type attempt: int
+        :param idempotent: override for a call, like a POST that only queries
+        :type idempotent: Optional[bool]
+        """
+        if attempt >= self.total:
+            return False
+        # the request never reached the server
+        if isinstance(exc, requests.exceptions.ConnectTimeout):
+            return True
+        if isinstance(
+            exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+        ):
+            return self.is_idempotent(method, idempotent)
+        return False
+
+    def get_delay(
+        self, attempt: int, response: Optional[requests.Response] = None
+    ) -> float:
+        """Return the seconds to wait before the next retry.
+
+        Honors Retry-After on the response, otherwise uses exponential
+        backoff with full jitter.
+
+        :param attempt: the number of retries done so far
+        :type attempt: int
+        :param response: the response that failed, if any
+        :type response: Optional[requests.Response]
+        """
+        if response is not None:
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if retry_after is not None:
+                return min(retry_after, self.backoff_max)
+        return random.uniform(
+            0, min(self.backoff_max, self.backoff_factor * 2**attempt)
+        )
+
+
+class RateLimiter:
+    """Thread safe token bucket limiting the rate of requests."""
+
+    def __init__(self, requests_per_second: float, burst: int = 1):
+        """Initialize the class.
+
+        :param requests_per_second: the sustained request rate
+        :type requests_per_second: float
+        :param burst: the requests that can be made at once after idling
+        :type burst: int
+        """
+        self.rate = requests_per_second
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.waited = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Block until a request can be made."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+                self.waited += wait
+            time.sleep(wait)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header, either seconds or an HTTP date.
+
+    :param value: the header value
+    :type value: Optional[str]
+    :return: the seconds to wait, None if missing or invalid
+    :rtype: Optional[float]
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def build_retry_policy(retry_settings: Optional[Dict[str, Any]] = None) -> RetryPolicy:
+    """Build a RetryPolicy from the [retry] settings.
+
+    :param retry_settings: the retry settings
+    :type retry_settings: Optional[Dict[str, Any]]
+    """
+    return RetryPolicy(**(retry_settings or {}))
+
+
+def build_rate_limiter(
+    rate_limit_settings: Optional[Dict[str, Any]] = None,
+) -> Optional[RateLimiter]:
+    """Build a RateLimiter from the [rate_limit] settings.
+
+    :param rate_limit_settings: the rate limit settings
+    :type rate_limit_settings: Optional[Dict[str, Any]]
+    :return: the limiter, None if no rate is set
+    :rtype: Optional[RateLimiter]
+    """
+    settings = rate_limit_settings or {}
+    rate = settings.get("requests_per_second")
+    if not rate:
+        return None
+    return RateLimiter(rate, settings.get("burst", 1))
@@ -0,0 +1,141 @@
+"""Incrementally decode the records of a large JSON document.
+
+Only the array being streamed is decoded record by record, so a response with
+thousands of records never has to be held in memory as a whole.
+
+>>> list(iter_json_array([b'{"records": [{"a": 1}, ', b'{"a": 2}], "num": 2}'],
+...                      key="records"))
+[{'a': 1}, {'a': 2}]
+>>> list(iter_json_array([b'[1, 2', b'3, 4]']))
+[1, 23, 4]
+>>> list(iter_json_array([b'[1.', b'5, 1e', b'3]']))
+[1.5, 1000.0]
+"""
+
+import codecs
+import json
+import re
+from typing import Any, Iterable, Iterator, Optional
+
+# what can follow the part of a number decoded so far at the end of the buffer
+NUMBER_TAIL_RE = re.compile(r"[0-9.eE+-]*\Z")
+
+
+class JSONStreamReader:
+    """Read JSON values one at a time from an iterable of byte chunks."""
+
+    def __init__(self, chunks: Iterable[bytes], encoding: str = "utf-8"):
+        """Initialize the class.
+
+        :param chunks: the byte chunks of the document
+        :type chunks: Iterable[bytes]
+        :param encoding: the encoding of the document
+        :type encoding: str
+        """
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.json_decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        """Read the next chunk into the buffer, False at the end of the data."""
+        if self.eof:
+            return False
+        # drop what has been consumed so the buffer only holds the unread data
+        if self.pos:
+            self.buf = self.buf[self.pos :]
+            self.pos = 0
+        for chunk in self.chunks:
+            text = self.decoder.decode(chunk)
+            if text:
+                self.buf += text
+                return True
+        self.buf += self.decoder.decode(b"", final=True)
+        self.eof = True
+        return False
+
+    def peek(self) -> str:
+        """Return the next non whitespace character without consuming it."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, chars: str) -> str:
+        """Consume the next non whitespace character, which must be in chars."""
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(
+                f"expected one of {chars!r} but found {char or 'end of data'!r}"
+            )
+        self.pos += 1
+        return char
+
+    def read_value(self) -> Any:
+        """Decode and consume the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # a number at the end of the buffer may continue in the next chunk,
+            # "1." or "1e" decode as 1 with the "." or "e" left over
+            if (
+                self.eof
+                or not isinstance(value, (int, float))
+                or not NUMBER_TAIL_RE.match(self.buf, end)
+            ):
+                self.pos = end
+                return value
+            self._fill()
+
+    def seek_key(self, key: str) -> None:
+        """Consume the top level object up to the value of key.
+
+        :param key: the key to find
+        :type key: str
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            raise KeyError(key)
+        while True:
+            name = self.read_value()
+            self.expect(":")
+            if name == key:
+                return
+            self.read_value()
+            if self.expect(",}") == "}":
+                raise KeyError(key)
+
+
+def iter_json_array(
+    chunks: Iterable[bytes], key: Optional[str] = None, encoding: str = "utf-8"
+) -> Iterator[Any]:
+    """Yield the items of a JSON array as they are decoded.
+
+    :param chunks: the byte chunks of the document
+    :type chunks: Iterable[bytes]
+    :param key: the top level key holding the array, None if the document is
+        the array
+    :type key: Optional[str]
+    :param encoding: the encoding of the document
+    :type encoding: str
+    """
+    reader = JSONStreamReader(chunks, encoding)
+    if key is not None:
+        reader.seek_key(key)
+    reader.expect("[")
+    if reader.peek() == "]":
+        return
+    while True:
+        yield reader.read_value()
+        if reader.expect(",]") == "]":
+            return
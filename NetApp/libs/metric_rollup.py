@@ -0,0 +1,101 @@
+"""Aggregate the raw volume metrics of a MetricDB into rollup tables.
+
+Every resolution gets a rollup_{resolution} table with the min, avg, max and
+p95 of each metric per bucket, so trend queries read one row per bucket
+instead of one row per minute.
+
+The rollups are saved to the same database or to a target database shared by
+the databases of every date, see rollup_metrics.py.
+"""
+
+import logging
+import time
+from typing import Any, Callable, Optional
+
+from libs.sqlite.metrics_db import MetricDB
+from libs.timeseries_table import ROLLUP_STATS, TimeseriesTable
+
+# resolution name -> bucket size in seconds
+ROLLUP_RESOLUTIONS = {"5m": 300, "1h": 3600, "1d": 86400}
+
+
+def rollup_table(
+    metrics_db: MetricDB,
+    key: Any,
+    target: Optional[MetricDB] = None,
+    target_key: Any = None,
+) -> Optional[int]:
+    """Update the rollups of one volume with the rows added since the last run.
+
+    :param metrics_db: the database, a MetricDB or a WideMetricDB
+    :type metrics_db: MetricDB
+    :param key: the volume, from metrics_db.get_volume_keys()
+    :type key: Any
+    :param target: the database the rollups are saved to, defaults to metrics_db
+    :type target: Optional[MetricDB]
+    :param target_key: the volume in target, defaults to key
+    :type target_key: Any
+    :return: the timestamp before which every raw row is in every rollup,
+        None if the volume has no rows
+    :rtype: Optional[int]
+    """
+    if target is None:
+        target = metrics_db
+    if target_key is None:
+        target_key = key
+    metrics = metrics_db.get_metric_columns(key)
+    rollup_columns = [f"{metric}_{stat}" for metric in metrics for stat in ROLLUP_STATS]
+
+    complete_before = None
+    for resolution, seconds in ROLLUP_RESOLUTIONS.items():
+        target.create_rollup_table(resolution, rollup_columns)
+        # the last bucket may have been partial, so it is computed again
+        since = target.get_last_rollup(resolution, target_key)
+        table = TimeseriesTable.from_records(metrics_db.get_rows(key, since), metrics)
+        if not len(table):
+            continue
+        rollup = table.resample(seconds)
+        target.upsert_rollup(resolution, target_key, rollup.to_records())
+        last_bucket = int(rollup.timestamps[-1])
+        if complete_before is None or last_bucket < complete_before:
+            complete_before = last_bucket
+    return complete_before
+
+
+def rollup_db(
+    metrics_db: MetricDB,
+    retention_days: float = 0,
+    now: Optional[float] = None,
+    target: Optional[MetricDB] = None,
+    target_key: Optional[Callable[[Any], Any]] = None,
+) -> None:
+    """Roll up every volume and prune the raw rows past the retention.
+
+    Only raw rows whose buckets are complete in every rollup are pruned.
+
+    :param metrics_db: the database
+    :type metrics_db: MetricDB
+    :param retention_days: the days of raw rows to keep, 0 keeps everything
+    :type retention_days: float
+    :param now: the current time in epoch seconds, defaults to time.time()
+    :type now: Optional[float]
+    :param target: the database the rollups are saved to, defaults to metrics_db
+    :type target: Optional[MetricDB]
+    :param target_key: returns the volume in target of a key of metrics_db,
+        defaults to the same key
+    :type target_key: Optional[Callable[[Any], Any]]
+    """
+    cutoff = (time.time() if now is None else now) - retention_days * 86400
+    pruned = 0
+    keys = metrics_db.get_volume_keys()
+    for key in keys:
+        complete_before = rollup_table(
+            metrics_db, key, target, target_key(key) if target_key else None
+        )
+        if retention_days and complete_before is not None:
+            pruned += metrics_db.prune(key, min(cutoff, complete_before))
+
+    logging.info(
+        f"Rolled up {len(keys)} volumes in {metrics_db.db_location},"
+        f" pruned {pruned} raw rows"
+    )
@@ -1,6 +1,7 @@
 import base64
 import logging
-from libs.openapi import APIWrapper
+from libs.openapi import APIWrapper, AsyncAPIWrapper
+from libs.sqlite.response_cache_db import ResponseCacheDB
 
 
 class ONTAPAPIClient(APIWrapper):
@@ -12,11 +13,34 @@ class ONTAPAPIClient(APIWrapper):
         b64string = base64.b64encode(f"{user}:{enc}".encode("ascii"))
         auth_header = {"authorization": f"Basic {b64string.decode()}"}
         # logging.info(f"b64 password: {b64string.decode()}")
+        kwargs.setdefault("spec_cache_dir", config.data_dir / "spec_cache")
+        kwargs.setdefault(
+            "connection_settings", config.settings["ontapapi"].get("connection", {})
+        )
+        kwargs.setdefault(
+            "retry_settings", config.settings["ontapapi"].get("retry", {})
+        )
+        kwargs.setdefault(
+            "rate_limit_settings", config.settings["ontapapi"].get("rate_limit", {})
+        )
+
+        # [response_cache] enabled, max_mb, default_ttl and [response_cache.ttls]
+        cache_settings = config.settings["ontapapi"].get("response_cache", {})
+        if cache_settings.get("enabled") and "response_cache" not in kwargs:
+            kwargs["response_cache"] = ResponseCacheDB(
+                config, max_bytes=cache_settings.get("max_mb", 256) * 1024 * 1024
+            )
+            kwargs.setdefault("cache_ttls", cache_settings.get("ttls", {}))
+            kwargs.setdefault("default_cache_ttl", cache_settings.get("default_ttl", 0))
 
         super().__init__(
             api_json_file=config.get_schema_location("ontap") / "all.json",
             base_url=f"https://{cluster.ip}",
             auth_header=auth_header,
-            base_api_path=self.config.settings["ontapapi"]["general"]["base_api_path"]
-            ** kwargs,
+            base_api_path=self.config.settings["ontapapi"]["general"]["base_api_path"],
+            **kwargs,
         )
+
+
+class AsyncONTAPAPIClient(ONTAPAPIClient, AsyncAPIWrapper):
+    """ONTAPAPIClient with concurrent calls, see AsyncAPIWrapper."""
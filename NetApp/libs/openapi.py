@@ -2,13 +2,59 @@
 
 # openapi.py
 
+import asyncio
+import copy
+import functools
+import hashlib
 import json
 import logging
+import os
+import pathlib
+import pickle
+import time
 import requests
-from typing import Any, Dict, List, Optional, Tuple, Union
-from jsonschema import validate, ValidationError
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+from jsonschema.exceptions import SchemaError, best_match
+from jsonschema.validators import validator_for
+from referencing import Registry, Resource
+from referencing.exceptions import Unresolvable
+from referencing.jsonschema import DRAFT202012
 from urllib.parse import urlencode
 
+from libs.http_utils import (
+    build_rate_limiter,
+    build_retry_policy,
+    configure_session,
+    connection_stats,
+)
+from libs.json_stream import iter_json_array
+
+HTTP_METHODS = ("get", "put", "post", "delete", "options", "head", "patch", "trace")
+
+# bump when the layout or the contents of the operation table change
+SPEC_CACHE_VERSION = 5
+
+# the uri of the spec in the registry the request body validators look $refs up in
+SPEC_URI = "urn:openapi-spec"
+
+# how many $refs deep a schema is inlined for reading, deeper $refs are left as is
+MAX_REF_DEPTH = 5
+
+# events that hooks can be added for, see APIWrapper.add_hook
+HOOK_EVENTS = ("pre_request", "post_response", "error")
+
 
 class APIWrapper:
     """Tiny OpenAPI wrapper client for path/param discovery + calling endpoints."""
@@ -21,6 +67,14 @@ class APIWrapper:
         timeout: float = 30.0,
         session: Optional[requests.Session] = None,
         base_api_path: str = "",
+        trust_bodies: bool = False,
+        spec_cache_dir: Optional[pathlib.Path] = None,
+        connection_settings: Optional[Dict[str, Any]] = None,
+        retry_settings: Optional[Dict[str, Any]] = None,
+        rate_limit_settings: Optional[Dict[str, Any]] = None,
+        response_cache: Optional[Any] = None,
+        cache_ttls: Optional[Dict[str, float]] = None,
+        default_cache_ttl: float = 0,
     ):
         """Initialize the class.
 
@@ -36,10 +90,35 @@ class APIWrapper:
         :type session: Optional[requests.Session]
         :param base_api_path: the base path of all api paths
         :type base_api_path: str
+        :param trust_bodies: skip request body validation for every call
+        :type trust_bodies: bool
+        :param spec_cache_dir: directory for the compiled spec cache, no cache if
+            not set
+        :type spec_cache_dir: Optional[pathlib.Path]
+        :param connection_settings: connection pool and keepalive settings, see
+            libs.http_utils, applied to new sessions or when given
+        :type connection_settings: Optional[Dict[str, Any]]
+        :param retry_settings: retry policy settings, see libs.http_utils
+        :type retry_settings: Optional[Dict[str, Any]]
+        :param rate_limit_settings: client side rate limit, see libs.http_utils
+        :type rate_limit_settings: Optional[Dict[str, Any]]
+        :param response_cache: a ResponseCacheDB to cache GET responses in
+        :type response_cache: Optional[Any]
+        :param cache_ttls: seconds a GET response stays fresh, by path template
+        :type cache_ttls: Optional[Dict[str, float]]
+        :param default_cache_ttl: ttl for paths not in cache_ttls, 0 to not cache
+        :type default_cache_ttl: float
         """
-        # Load the API spec
-        with open(api_json_file, encoding="utf-8") as f:
-            self.api_spec: Dict[str, Any] = json.load(f)
+        # Load the API spec and the operation table
+        self.api_spec: Dict[str, Any] = {}
+        self.operations: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._load_spec(pathlib.Path(api_json_file), spec_cache_dir)
+        # The validators look the $refs of a request schema up in the spec when
+        # a body reaches them, so recursive schemas are validated at any depth
+        self._registry = Registry().with_resource(
+            SPEC_URI,
+            Resource.from_contents(self.api_spec, default_specification=DRAFT202012),
+        )
 
         self.base_api_path = base_api_path
         if not base_api_path:
@@ -58,6 +137,8 @@ class APIWrapper:
         self.base_url = base_url.rstrip("/")
         self.timeout = timeout
         self.session = session or requests.Session()
+        if connection_settings or not session:
+            configure_session(self.session, connection_settings)
         # Default headers (can be extended per request)
         default_headers = {
             "Content-Type": "application/json",
@@ -66,8 +147,192 @@ class APIWrapper:
         self.session.headers.update(default_headers)
         self.session.headers.update(auth_header)
 
+        # Retry transient failures and optionally throttle all requests
+        self.retry_policy = build_retry_policy(retry_settings)
+        self.rate_limiter = build_rate_limiter(rate_limit_settings)
+
+        # Optional on disk cache of GET responses
+        self.response_cache = response_cache
+        self.cache_ttls = cache_ttls or {}
+        self.default_cache_ttl = default_cache_ttl
+
+        # Instrumentation hooks, see add_hook
+        self.hooks: Dict[str, List[Callable[[Dict[str, Any]], None]]] = {
+            event: [] for event in HOOK_EVENTS
+        }
+
+        # Request body validators, compiled on first use of an endpoint
+        self.trust_bodies = trust_bodies
+        self._validators: Dict[Tuple[str, str], Any] = {}
+        self.validator_stats = {"hits": 0, "misses": 0, "skipped": 0}
+
     # -------------------------- Internal helpers ---------------------------
 
+    def _load_spec(
+        self, api_json_file: pathlib.Path, spec_cache_dir: Optional[pathlib.Path]
+    ) -> None:
+        """Load the spec and operation table, from the cache when it is current.
+
+        The cache is used as is when the mtime and size of the json file match,
+        otherwise the json file is hashed and the cache is only rebuilt if the
+        contents changed.
+
+        :param api_json_file: the api json file to parse
+        :type api_json_file: pathlib.Path
+        :param spec_cache_dir: directory for the compiled spec cache
+        :type spec_cache_dir: Optional[pathlib.Path]
+        """
+        if not spec_cache_dir:
+            with open(api_json_file, encoding="utf-8") as f:
+                self.api_spec = json.load(f)
+            # Walk the spec once, every call after this is a dict lookup
+            self.operations = self._compile_operations()
+            return
+
+        cache_file = (
+            pathlib.Path(spec_cache_dir)
+            / f"{api_json_file.parent.name}_{api_json_file.stem}.pickle"
+        )
+        stat = api_json_file.stat()
+        cached = self._read_spec_cache(cache_file)
+
+        if (
+            cached
+            and cached["mtime_ns"] == stat.st_mtime_ns
+            and cached["size"] == stat.st_size
+        ):
+            logging.debug(f"_load_spec: using {cache_file}")
+            self.api_spec = cached["api_spec"]
+            self.operations = cached["operations"]
+            return
+
+        raw = api_json_file.read_bytes()
+        digest = hashlib.sha256(raw).hexdigest()
+        if cached and cached["sha256"] == digest:
+            logging.debug(f"_load_spec: {api_json_file} touched but unchanged")
+            self.api_spec = cached["api_spec"]
+            self.operations = cached["operations"]
+        else:
+            logging.info(f"_load_spec: compiling {api_json_file} into {cache_file}")
+            self.api_spec = json.loads(raw)
+            self.operations = self._compile_operations()
+
+        self._write_spec_cache(
+            cache_file,
+            {
+                "version": SPEC_CACHE_VERSION,
+                "source": str(api_json_file),
+                "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "sha256": digest,
+                "api_spec": self.api_spec,
+                "operations": self.operations,
+            },
+        )
+
+    def _read_spec_cache(self, cache_file: pathlib.Path) -> Optional[Dict[str, Any]]:
+        """Read a compiled spec cache file.
+
+        :param cache_file: the cache file
+        :type cache_file: pathlib.Path
+        :return: the cached data, None if missing, unreadable or outdated
+        :rtype: Optional[Dict[str, Any]]
+        """
+        try:
+            with open(cache_file, "rb") as f:
+                cached = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"_read_spec_cache: could not read {cache_file}: {e}")
+            return None
+
+        if not isinstance(cached, dict) or cached.get("version") != (
+            SPEC_CACHE_VERSION
+        ):
+            logging.debug(f"_read_spec_cache: {cache_file} is an old version")
+            return None
+        return cached
+
+    def _write_spec_cache(self, cache_file: pathlib.Path, data: Dict[str, Any]) -> None:
+        """Write a compiled spec cache file atomically.
+
+        :param cache_file: the cache file
+        :type cache_file: pathlib.Path
+        :param data: the data to cache
+        :type data: Dict[str, Any]
+        """
+        os.makedirs(cache_file.parent, exist_ok=True)
+        tmp_file = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp_file, "wb") as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, cache_file)
+        except Exception as e:
+            logging.warning(f"_write_spec_cache: could not write {cache_file}: {e}")
+            tmp_file.unlink(missing_ok=True)
+
+    def _compile_operations(self) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        """Build the operation table for every path and method in the spec.
+
+        Each entry holds the raw operation, the resolved path and query
+        parameters and the request schema with its $refs left in place.
+
+        :return: the table keyed by (path template, lowercase method)
+        :rtype: Dict[Tuple[str, str], Dict[str, Any]]
+        """
+        operations: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for api_path, path_item in self.api_spec.get("paths", {}).items():
+            for method, operation in path_item.items():
+                if method not in HTTP_METHODS or not isinstance(operation, dict):
+                    continue
+                operations[(api_path, method)] = self._compile_operation(operation)
+        logging.debug(f"_compile_operations: compiled {len(operations)} operations")
+        return operations
+
+    def _compile_operation(self, operation: Dict[str, Any]) -> Dict[str, Any]:
+        """Compile a single operation into an operation table entry.
+
+        :param operation: the operation object from the spec
+        :type operation: Dict[str, Any]
+        :return: the operation table entry
+        :rtype: Dict[str, Any]
+        """
+        params = [self._resolve_refs(p) for p in operation.get("parameters") or []]
+
+        content = (
+            operation.get("requestBody", {})
+            .get("content", {})
+            .get("application/json", {})
+        )
+        request_schema = content.get("schema") or None
+
+        return {
+            "operation": operation,
+            "path_params": [p for p in params if p.get("in") == "path"],
+            "query_params": [p for p in params if p.get("in") == "query"],
+            "request_schema": request_schema,
+        }
+
+    def _get_compiled(self, api_path: str, method: str) -> Dict[str, Any]:
+        """Get the operation table entry for an API path.
+
+        :param api_path: the api path to use, such as /storage/assets
+        :type api_path: str
+        :param method: the method (get, put, etc)
+        :type method: str
+        :return: the compiled entry, empty if the path or method is unknown
+        :rtype: Dict[str, Any]
+        """
+        compiled = self.operations.get((api_path, method.lower()))
+        if compiled is None:
+            if api_path not in self.api_spec["paths"]:
+                logging.error(f"_get_operation: did not find {api_path}")
+            else:
+                logging.error(f"_get_operation: could not find {method} for {api_path}")
+            return {}
+        return compiled
+
     def _get_operation(self, api_path: str, method: str) -> Dict[str, Any]:
         """Get the operation for an API path.
 
@@ -78,14 +343,59 @@ class APIWrapper:
         :return: various info about the path and method
         :rtype: Dict[str, Any]
         """
-        method = method.lower()
-        path = self.api_spec["paths"].get(api_path, {})
-        if not path:
-            logging.error(f"_get_operation: did not find {api_path}")
-        operation = path.get(method, {})
-        if not operation:
-            logging.error(f"_get_operation: could not find {operation} for {api_path}")
-        return operation
+        return self._get_compiled(api_path, method).get("operation", {})
+
+    def _get_validator(self, api_path: str, method: str) -> Any:
+        """Get the cached request body validator for an API path.
+
+        The schema is checked and the validator compiled the first time the
+        endpoint is validated, later calls reuse it.
+
+        :param api_path: the api path to use, such as /storage/assets
+        :type api_path: str
+        :param method: the method (get, put, etc)
+        :type method: str
+        :return: the validator, None if the endpoint has no usable schema
+        :rtype: Any
+        """
+        key = (api_path, method.lower())
+        try:
+            validator = self._validators[key]
+            self.validator_stats["hits"] += 1
+            return validator
+        except KeyError:
+            self.validator_stats["misses"] += 1
+
+        validator = None
+        schema = self._get_compiled(api_path, method).get("request_schema")
+        if schema:
+            # validate against the schema where it is in the spec, its $refs are
+            # then relative to the spec
+            pointer = "/".join(
+                part.replace("~", "~0").replace("/", "~1")
+                for part in (
+                    "paths",
+                    api_path,
+                    method.lower(),
+                    "requestBody",
+                    "content",
+                    "application/json",
+                    "schema",
+                )
+            )
+            cls = validator_for(schema)
+            try:
+                cls.check_schema(schema)
+                validator = cls(
+                    {"$ref": f"{SPEC_URI}#/{pointer}"}, registry=self._registry
+                )
+            except SchemaError as e:
+                logging.error(
+                    f"_get_validator: invalid schema for {api_path}:{method}:"
+                    f" {e.message}"
+                )
+        self._validators[key] = validator
+        return validator
 
     def _resolve_ref(self, ref: str) -> Any:
         """Resolve refs like '#/components/schemas/SomeSchema' against the api_spec."""
@@ -100,15 +410,28 @@ class APIWrapper:
             new_ref = new_ref[key]
         return new_ref
 
-    def _resolve_refs(self, schema: Any) -> Any:
-        """Deep-resolve $ref in the provided schema dict/list/primitive."""
+    def _resolve_refs(self, schema: Any, refs: Tuple[str, ...] = ()) -> Any:
+        """Inline the $refs of a schema dict/list/primitive for reading.
+
+        A $ref back to a schema it is nested in (a recursive schema) or more
+        than MAX_REF_DEPTH $refs deep is left as is. Parts of the result are
+        shared with the spec, treat it as read only. Validation does not use
+        this, see _get_validator.
+
+        :param schema: the schema
+        :type schema: Any
+        :param refs: the $refs the schema is nested in
+        :type refs: Tuple[str, ...]
+        """
         if isinstance(schema, dict):
             if "$ref" in schema:
-                target = self._resolve_ref(schema["$ref"])
-                return self._resolve_refs(target)
-            return {k: self._resolve_refs(v) for k, v in schema.items()}
+                ref = schema["$ref"]
+                if ref in refs or len(refs) >= MAX_REF_DEPTH:
+                    return schema
+                return self._resolve_refs(self._resolve_ref(ref), refs + (ref,))
+            return {k: self._resolve_refs(v, refs) for k, v in schema.items()}
         if isinstance(schema, list):
-            return [self._resolve_refs(item) for item in schema]
+            return [self._resolve_refs(item, refs) for item in schema]
         return schema
 
     def _format_path(
@@ -129,36 +452,182 @@ class APIWrapper:
         self, path_template: str, method: str
     ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
         """Return (path_params, query_params) lists from the spec entry."""
-        op = self._get_operation(path_template, method)
-        params = op.get("parameters", []) or []
-        path_params = [p for p in params if p.get("in") == "path"]
-        query_params = [p for p in params if p.get("in") == "query"]
-        return path_params, query_params
+        compiled = self._get_compiled(path_template, method)
+        return compiled.get("path_params", []), compiled.get("query_params", [])
 
     def _get_request_schema(
         self, path_template: str, method: str
     ) -> Optional[Dict[str, Any]]:
-        """Return the resolved JSON Schema dict for the request body if present.
+        """Return the JSON Schema dict for the request body if present.
 
-        Only supports application/json for simplicity.
+        Only supports application/json for simplicity. The $refs are inlined up
+        to MAX_REF_DEPTH deep, see _resolve_refs.
         """
-        op = self._get_operation(path_template, method)
+        compiled = self._get_compiled(path_template, method)
+        schema = compiled.get("request_schema")
 
-        content = (
-            op.get("requestBody", {}).get("content", {}).get("application/json", {})
-        )
-
-        if not content:
+        if not schema:
             logging.error(
                 f"_get_request_schema: no content for {path_template}:{method}"
             )
-
-        schema = content.get("schema")
-
-        if not schema:
             return None
         return self._resolve_refs(schema)
 
+    def _run_hooks(self, event: str, info: Dict[str, Any]) -> None:
+        """Call the hooks for an event, a failing hook never fails the request."""
+        for hook in self.hooks[event]:
+            try:
+                hook(info)
+            except Exception as e:
+                logging.error(f"{event} hook {hook} failed", exc_info=e)
+
+    def _send(
+        self,
+        method: str,
+        url: str,
+        body: Optional[Dict[str, Any]],
+        headers: Dict[str, str],
+        idempotent: Optional[bool] = None,
+        stream: bool = False,
+        context: Optional[Dict[str, Any]] = None,
+    ) -> requests.Response:
+        """Send a request, retrying transient failures per the retry policy.
+
+        :param method: the HTTP method
+        :type method: str
+        :param url: the full url
+        :type url: str
+        :param body: the json body
+        :type body: Optional[Dict[str, Any]]
+        :param headers: the headers for the request
+        :type headers: Dict[str, str]
+        :param idempotent: override if the call can be safely repeated
+        :type idempotent: Optional[bool]
+        :param stream: do not download the body until it is read
+        :type stream: bool
+        :param context: extra info for the hooks, like the path template
+        :type context: Optional[Dict[str, Any]]
+        :return: the final response, raises for HTTP errors
+        :rtype: requests.Response
+        """
+        attempt = 0
+        while True:
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            info = {**(context or {}), "method": method, "url": url, "attempt": attempt}
+            self._run_hooks("pre_request", info)
+            start = time.perf_counter()
+            try:
+                resp = self.session.request(
+                    method,
+                    url,
+                    json=body,
+                    headers=headers,
+                    timeout=self.timeout,
+                    verify=False,
+                    stream=stream,
+                )
+            except requests.exceptions.RequestException as e:
+                info["elapsed"] = time.perf_counter() - start
+                info["error"] = e
+                self._run_hooks("error", info)
+                if not self.retry_policy.should_retry_exception(
+                    method, e, attempt, idempotent
+                ):
+                    raise
+                delay = self.retry_policy.get_delay(attempt)
+                logging.warning(
+                    f"{method} {url} failed with {e!r},"
+                    f" retry {attempt + 1} in {delay:.2f}s"
+                )
+            else:
+                logging.debug(f"Response Status Code: {resp.status_code}")
+                if self.hooks["post_response"]:
+                    info["elapsed"] = time.perf_counter() - start
+                    info["status"] = resp.status_code
+                    request_body = resp.request.body
+                    info["bytes_sent"] = len(request_body) if request_body else 0
+                    info["bytes_received"] = (
+                        int(resp.headers.get("Content-Length", 0))
+                        if stream
+                        else len(resp.content)
+                    )
+                    self._run_hooks("post_response", info)
+                if not self.retry_policy.should_retry_status(
+                    method, resp.status_code, attempt, idempotent
+                ):
+                    resp.raise_for_status()
+                    return resp
+                delay = self.retry_policy.get_delay(attempt, resp)
+                logging.warning(
+                    f"{method} {url} returned {resp.status_code},"
+                    f" retry {attempt + 1} in {delay:.2f}s"
+                )
+                resp.close()
+
+            attempt += 1
+            time.sleep(delay)
+
+    def _decode_body(self, content: bytes) -> Any:
+        """Decode a cached response body as JSON, else return the text."""
+        try:
+            return json.loads(content)
+        except ValueError:
+            return content.decode("utf-8", errors="replace")
+
+    def _cached_get(
+        self,
+        url: str,
+        headers: Dict[str, str],
+        ttl: float,
+        context: Optional[Dict[str, Any]] = None,
+    ) -> Any:
+        """GET a url through the response cache.
+
+        A response younger than ttl is returned without a request. An older
+        one is revalidated with If-None-Match/If-Modified-Since when the
+        server sent an ETag or Last-Modified.
+
+        :param url: the full url, including the query
+        :type url: str
+        :param headers: the headers for the request
+        :type headers: Dict[str, str]
+        :param ttl: the seconds a response stays fresh
+        :type ttl: float
+        :param context: extra info for the hooks, like the path template
+        :type context: Optional[Dict[str, Any]]
+        """
+        cache: Any = self.response_cache
+        cached = cache.get(url)
+        if cached is not None:
+            if time.time() - cached["stored_at"] < ttl:
+                cache.stats["hits"] += 1
+                logging.debug(f"Response cache hit for {url}")
+                return self._decode_body(cached["body"])
+            headers = dict(headers)
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        logging.debug(f"Calling GET {url} {headers}")
+        resp = self._send("GET", url, None, headers, context=context)
+        if resp.status_code == 304 and cached is not None:
+            cache.stats["revalidated"] += 1
+            logging.debug(f"Response cache revalidated {url}")
+            cache.touch(url)
+            return self._decode_body(cached["body"])
+
+        cache.stats["misses"] += 1
+        if "no-store" not in resp.headers.get("Cache-Control", ""):
+            cache.put(
+                url,
+                resp.content,
+                etag=resp.headers.get("ETag"),
+                last_modified=resp.headers.get("Last-Modified"),
+            )
+        return self._decode_body(resp.content)
+
     def _build_sample_from_schema(self, schema: Dict[str, Any]) -> Any:
         """Heuristic sample generator for a JSON Schema object.
 
@@ -172,7 +641,6 @@ class APIWrapper:
             required = set(schema.get("required", []))
             sample = {}
             for name, sub in props.items():
-                sub = self._resolve_refs(sub)
                 subtype = sub.get("type")
                 enum = sub.get("enum")
                 if enum:
@@ -214,6 +682,31 @@ class APIWrapper:
 
     # ------------------------------ Public API ------------------------------
 
+    def add_hook(self, event: str, hook: Callable[[Dict[str, Any]], None]) -> None:
+        """Add a hook that is called for every request attempt.
+
+        Hooks get a dict with method, url, path_template, attempt and
+        validation_time. post_response adds status, elapsed, bytes_sent and
+        bytes_received, error adds error and elapsed. See libs.api_metrics for
+        a hook that collects histograms.
+
+        :param event: one of pre_request, post_response or error
+        :type event: str
+        :param hook: the callable
+        :type hook: Callable[[Dict[str, Any]], None]
+        """
+        if event not in self.hooks:
+            raise ValueError(f"unknown hook event {event}, use one of {HOOK_EVENTS}")
+        self.hooks[event].append(hook)
+
+    def remove_hook(self, event: str, hook: Callable[[Dict[str, Any]], None]) -> None:
+        """Remove a hook added with add_hook."""
+        self.hooks[event].remove(hook)
+
+    def connection_stats(self) -> Dict[str, Any]:
+        """Return how many requests reused a pooled connection, see libs.http_utils."""
+        return connection_stats(self.session)
+
     def list_endpoints(self) -> List[Tuple[str, str, Optional[str]]]:
         """Return list of (path, METHOD, summary) triples for quick discovery."""
         items: List[Tuple[str, str, Optional[str]]] = []
@@ -248,7 +741,8 @@ class APIWrapper:
             return None
 
         if not human_readable:
-            return resolved
+            # parts of the resolved schema are shared with the spec
+            return copy.deepcopy(resolved)
 
         def describe(schema: Dict[str, Any]) -> Dict[str, Any]:
             info: Dict[str, Any] = {"type": schema.get("type", "object")}
@@ -256,7 +750,6 @@ class APIWrapper:
             required = set(schema.get("required", []))
             fields: Dict[str, Any] = {}
             for name, sub in props.items():
-                sub = self._resolve_refs(sub)
                 fields[name] = {
                     "type": sub.get(
                         "type", "object" if "properties" in sub else "unknown"
@@ -277,22 +770,33 @@ class APIWrapper:
         path_template: str,
         method: str = "GET",
         body: Optional[Dict[str, Any]] = None,
+        trusted: bool = False,
     ) -> bool:
         """Validate 'body' against the endpoint's resolved schema (if any).
 
-        If no body or no schema is present, returns True.
+        If no body or no schema is present, or the body is trusted,
+        returns True.
         """
         if body is None:
             return True
-        schema = self._get_request_schema(path_template, method)
-        if not schema:
+        if trusted or self.trust_bodies:
+            self.validator_stats["skipped"] += 1
+            return True
+        validator = self._get_validator(path_template, method)
+        if not validator:
             return True
         try:
-            validate(instance=body, schema=schema)
+            error = best_match(validator.iter_errors(body))
+        except Unresolvable as e:
+            logging.warning(
+                f"validate_body: could not resolve {e} for {path_template}:{method},"
+                f" body not validated"
+            )
             return True
-        except ValidationError as e:
-            logging.error(f"Request body validation error: {e.message}")
+        if error is not None:
+            logging.error(f"Request body validation error: {error.message}")
             return False
+        return True
 
     def suggest_parameters(
         self, path_template: str, method: str = "GET"
@@ -337,25 +841,33 @@ class APIWrapper:
             "body_sample": body_sample,
         }
 
-    def call_endpoint(
+    def _prepare_call(
         self,
         path_template: str,
-        method: str = "GET",
-        path_params: Optional[Dict[str, Any]] = None,
-        query_params: Optional[Dict[str, Any]] = None,
-        body: Optional[Dict[str, Any]] = None,
-        additional_headers: Optional[Dict[str, str]] = None,
-    ) -> Any:
-        """Make the HTTP call.
+        method: str,
+        path_params: Optional[Dict[str, Any]],
+        query_params: Optional[Dict[str, Any]],
+        body: Optional[Dict[str, Any]],
+        additional_headers: Optional[Dict[str, str]],
+        trusted_body: bool,
+    ) -> Tuple[str, str, Dict[str, str], Dict[str, Any]]:
+        """Validate the body and build the url and headers for a call.
 
-        Validates body (if schema exists) and raises for HTTP errors.
+        :return: the uppercase method, the url, the headers and the context
+            for the hooks
+        :rtype: Tuple[str, str, Dict[str, str], Dict[str, Any]]
         """
         method = method.upper()
         # path_template = f"{self.base_api_path}{path_template}"
 
         # Validate body against the schema for the *template* path
-        if not self.validate_body(path_template, method, body):
+        start = time.perf_counter()
+        if not self.validate_body(path_template, method, body, trusted_body):
             raise ValueError("Request body validation failed.")
+        context = {
+            "path_template": path_template,
+            "validation_time": time.perf_counter() - start,
+        }
 
         # Build URL (formatting path placeholders)
         path = self._format_path(path_template, path_params)
@@ -372,16 +884,306 @@ class APIWrapper:
         if additional_headers:
             headers.update(additional_headers)
 
-        logging.debug(f"Calling {method} {url} {headers}")
-        resp = self.session.request(
-            method, url, json=body, headers=headers, timeout=self.timeout, verify=False
+        return method, url, headers, context
+
+    def call_endpoint(
+        self,
+        path_template: str,
+        method: str = "GET",
+        path_params: Optional[Dict[str, Any]] = None,
+        query_params: Optional[Dict[str, Any]] = None,
+        body: Optional[Dict[str, Any]] = None,
+        additional_headers: Optional[Dict[str, str]] = None,
+        trusted_body: bool = False,
+        idempotent: Optional[bool] = None,
+    ) -> Any:
+        """Make the HTTP call.
+
+        Validates body (if schema exists and it is not trusted), retries
+        transient failures and raises for HTTP errors.
+
+        Only idempotent methods are retried after the server may have acted on
+        the request, pass idempotent=True for a POST that only queries.
+
+        GET responses are served from the response cache when one is set and
+        the path has a ttl.
+        """
+        method, url, headers, context = self._prepare_call(
+            path_template,
+            method,
+            path_params,
+            query_params,
+            body,
+            additional_headers,
+            trusted_body,
         )
-        logging.debug(f"Response Status Code: {resp.status_code}")
-        resp.raise_for_status()
+
+        if method == "GET" and self.response_cache is not None:
+            ttl = self.cache_ttls.get(path_template, self.default_cache_ttl)
+            if ttl > 0:
+                return self._cached_get(url, headers, ttl, context)
+
+        logging.debug(f"Calling {method} {url} {headers}")
+        resp = self._send(method, url, body, headers, idempotent, context=context)
 
         # Try JSON, else return text
         try:
-            logging.debug(f"Response Text: {resp.text}")
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug(f"Response Text: {resp.text}")
             return resp.json()
         except ValueError:
             return resp.text
+
+    def stream_endpoint(
+        self,
+        path_template: str,
+        method: str = "GET",
+        path_params: Optional[Dict[str, Any]] = None,
+        query_params: Optional[Dict[str, Any]] = None,
+        body: Optional[Dict[str, Any]] = None,
+        additional_headers: Optional[Dict[str, str]] = None,
+        trusted_body: bool = False,
+        idempotent: Optional[bool] = None,
+        records_key: Optional[str] = "records",
+        chunk_size: int = 65536,
+    ) -> Iterator[Any]:
+        """Make the HTTP call and yield the records as they are decoded.
+
+        Takes the same arguments as call_endpoint. The response is read in
+        chunks and never held in memory as a whole.
+
+        :param records_key: the top level key of the records array, None if
+            the response is the array
+        :type records_key: Optional[str]
+        :param chunk_size: the number of bytes to read at a time
+        :type chunk_size: int
+        """
+        method, url, headers, context = self._prepare_call(
+            path_template,
+            method,
+            path_params,
+            query_params,
+            body,
+            additional_headers,
+            trusted_body,
+        )
+
+        logging.debug(f"Streaming {method} {url} {headers}")
+        resp = self._send(
+            method, url, body, headers, idempotent, stream=True, context=context
+        )
+        count = 0
+        try:
+            for record in iter_json_array(
+                resp.iter_content(chunk_size), records_key, resp.encoding or "utf-8"
+            ):
+                count += 1
+                yield record
+        finally:
+            resp.close()
+        logging.debug(f"Streamed {count} records from {url}")
+
+    def _get_page(
+        self,
+        url: str,
+        headers: Dict[str, str],
+        records_key: Optional[str],
+        context: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[List[Any], Optional[str]]:
+        """Get one page of a collection.
+
+        :return: the records and the href of the next page if the response
+            links to one
+        :rtype: Tuple[List[Any], Optional[str]]
+        """
+        logging.debug(f"Paging GET {url}")
+        response = self._send("GET", url, None, headers, context=context).json()
+        if isinstance(response, list):
+            return response, None
+        records = response.get(records_key, []) if records_key else []
+        next_href = response.get("_links", {}).get("next", {}).get("href")
+        return records, next_href
+
+    def iter_collection(
+        self,
+        path_template: str,
+        path_params: Optional[Dict[str, Any]] = None,
+        query_params: Optional[Dict[str, Any]] = None,
+        additional_headers: Optional[Dict[str, str]] = None,
+        records_key: Optional[str] = "records",
+        paging: str = "links",
+        page_size: Optional[int] = None,
+        prefetch: bool = False,
+    ) -> Iterator[Any]:
+        """Yield every record of a collection, following the pages.
+
+        paging="links" follows the _links.next href of ONTAP responses,
+        page_size is sent as max_records. paging="offset" sends offset and
+        limit (DII) and stops at the first page with fewer than page_size
+        records.
+
+        :param records_key: the key of the records in a page, ignored if the
+            page is a list
+        :type records_key: Optional[str]
+        :param paging: "links" or "offset"
+        :type paging: str
+        :param page_size: the number of records per page, required for offset
+        :type page_size: Optional[int]
+        :param prefetch: get the next page in the background while the
+            current one is processed
+        :type prefetch: bool
+        """
+        if paging not in ("links", "offset"):
+            raise ValueError(f"unknown paging {paging}")
+        if paging == "offset" and not page_size:
+            raise ValueError("offset paging needs a page_size")
+
+        query_params = dict(query_params or {})
+        if paging == "offset":
+            query_params["limit"] = page_size
+            query_params.setdefault("offset", 0)
+        elif page_size:
+            query_params["max_records"] = page_size
+
+        context = {"path_template": path_template, "validation_time": 0.0}
+
+        def page_url(offset: Optional[int] = None) -> Tuple[str, Dict[str, str]]:
+            if offset is not None:
+                query_params["offset"] = offset
+            _, url, headers, _ = self._prepare_call(
+                path_template,
+                "GET",
+                path_params,
+                query_params,
+                None,
+                additional_headers,
+                True,
+            )
+            return url, headers
+
+        url, headers = page_url()
+        offset = query_params.get("offset", 0)
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            pending = None
+            page = self._get_page(url, headers, records_key, context)
+            while True:
+                records, next_href = page
+                next_url = None
+                if paging == "links" and next_href:
+                    next_url = f"{self.base_url}{next_href}"
+                elif paging == "offset" and len(records) >= page_size:
+                    offset += len(records)
+                    next_url, headers = page_url(offset)
+
+                if next_url and executor:
+                    pending = executor.submit(
+                        self._get_page, next_url, headers, records_key, context
+                    )
+
+                yield from records
+
+                if not next_url:
+                    return
+                if pending:
+                    page = pending.result()
+                    pending = None
+                else:
+                    page = self._get_page(next_url, headers, records_key, context)
+        finally:
+            if executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+
+class AsyncAPIWrapper(APIWrapper):
+    """APIWrapper that can keep many requests in flight from asyncio.
+
+    Calls go through the same path/param/validation code as APIWrapper and
+    run on a worker pool, with at most max_concurrency in flight at once.
+    """
+
+    def __init__(self, *args, max_concurrency: int = 32, **kwargs):
+        """Initialize the class.
+
+        Takes the same arguments as APIWrapper plus max_concurrency.
+
+        :param max_concurrency: the maximum number of requests in flight
+        :type max_concurrency: int
+        """
+        if not kwargs.get("session"):
+            # keep at least one pooled connection per worker alive
+            kwargs["connection_settings"] = {
+                "pool_maxsize": max_concurrency,
+                **(kwargs.get("connection_settings") or {}),
+            }
+        super().__init__(*args, **kwargs)
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="apiwrapper"
+        )
+        # asyncio semaphores are bound to a loop, keep one per running loop
+        self._semaphores: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """Return the concurrency semaphore for the running loop."""
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphores[loop] = semaphore
+        return semaphore
+
+    async def acall_endpoint(
+        self, path_template: str, method: str = "GET", **kwargs
+    ) -> Any:
+        """Make the HTTP call without blocking the event loop.
+
+        Takes the same arguments as call_endpoint.
+        """
+        async with self._get_semaphore():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor,
+                functools.partial(self.call_endpoint, path_template, method, **kwargs),
+            )
+
+    async def gather_endpoints(
+        self, calls: Iterable[Dict[str, Any]], return_exceptions: bool = False
+    ) -> List[Any]:
+        """Make many HTTP calls concurrently.
+
+        :param calls: the keyword arguments for call_endpoint, one dict per call
+        :type calls: Iterable[Dict[str, Any]]
+        :param return_exceptions: return exceptions in the results instead of
+            raising the first one
+        :type return_exceptions: bool
+        :return: the results in the same order as calls
+        :rtype: List[Any]
+        """
+        return await asyncio.gather(
+            *(self.acall_endpoint(**call) for call in calls),
+            return_exceptions=return_exceptions,
+        )
+
+    def call_many(
+        self, calls: Iterable[Dict[str, Any]], return_exceptions: bool = False
+    ) -> List[Any]:
+        """Make many HTTP calls concurrently from synchronous code.
+
+        Runs gather_endpoints in its own event loop, so it cannot be used from
+        inside a running loop.
+
+        :param calls: the keyword arguments for call_endpoint, one dict per call
+        :type calls: Iterable[Dict[str, Any]]
+        :param return_exceptions: return exceptions in the results instead of
+            raising the first one
+        :type return_exceptions: bool
+        :return: the results in the same order as calls
+        :rtype: List[Any]
+        """
+        return asyncio.run(self.gather_endpoints(calls, return_exceptions))
+
+    def close(self) -> None:
+        """Stop the worker pool and close the session."""
+        self._executor.shutdown(wait=True)
+        self.session.close()
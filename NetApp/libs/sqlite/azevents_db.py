@@ -1,6 +1,11 @@
 import sqlite3
+import itertools
 from datetime import datetime
 
+from libs.sqlite.connection import BulkMixin, connect
+from libs.sqlite.query_plan import check_query_plans
+from libs.sqlite.statements import upsert_sql
+
 # Adapter to convert datetime to string
 def adapt_datetime(dt):
     return dt.isoformat()
@@ -22,12 +27,26 @@ sqlite3.register_converter("node_ready_for_giveback", convert_datetime)
 sqlite3.register_converter("node_giveback_starts", convert_datetime)
 sqlite3.register_converter("node_giveback_complete", convert_datetime)
 
-class AzEventsDB:
+class AzEventsDB(BulkMixin):
+    # the columns get_events_between_datetimes can search
+    TIMING_COLUMNS = ('az_maint_not_before', 'az_maint_scheduled', 'az_maint_started',
+                      'az_maint_complete', 'node_takeover_complete', 'node_reboot_starts',
+                      'node_reboot_complete', 'node_ready_for_giveback',
+                      'node_giveback_starts', 'node_giveback_complete')
+    INDEXED_COLUMNS = ('cluster', 'node', *TIMING_COLUMNS)
+    QUERIES = {
+        'get_event_by_id': 'SELECT * FROM maintenance_events WHERE event_id = ?',
+        'get_events_by_cluster': 'SELECT * FROM maintenance_events WHERE cluster = ?',
+        'get_events_by_node': 'SELECT * FROM maintenance_events WHERE node = ?',
+        'get_events_between_datetimes': 'SELECT * FROM maintenance_events WHERE {field} BETWEEN ? AND ?',
+    }
+
     def __init__(self, config, db_name='azevents.db'):
         db_location = config.db_dir / db_name
-        self.conn = sqlite3.connect(db_location, detect_types=sqlite3.PARSE_DECLTYPES)
+        self.conn = connect(db_location, detect_types=sqlite3.PARSE_DECLTYPES)
         self.conn.row_factory = sqlite3.Row  # Enables dictionary-like access        
         self.create_table()
+        self.create_indexes()
 
     def create_table(self):
         # Check if the table already exists
@@ -37,7 +56,7 @@ class AzEventsDB:
         ''')
         if cur.fetchone() is None:
             # Create the table if it does not exist
-            with self.conn:
+            with self.transaction():
                 self.conn.execute('''
                     CREATE TABLE IF NOT EXISTS maintenance_events (
                         event_id TEXT PRIMARY KEY,
@@ -57,39 +76,53 @@ class AzEventsDB:
                     )
                 ''')
 
-    def upsert_event(self, event):
-        # Dynamically create the insert string
-        columns = ', '.join(event.keys())
-        placeholders = ', '.join(f':{key}' for key in event.keys())
-        updates = ', '.join(f'{key}=excluded.{key}' for key in event.keys())
+    def create_indexes(self):
+        """Index the columns the get_events_* methods search, also on existing databases."""
+        with self.transaction():
+            for column in self.INDEXED_COLUMNS:
+                self.conn.execute(f'CREATE INDEX IF NOT EXISTS maintenance_events_{column} '
+                                  f'ON maintenance_events ({column})')
+
+    def check_query_plans(self):
+        """Return the queries of the get_* methods that do not use an index, see query_plan.check_query_plans."""
+        queries = {name: (sql, ('',)) for name, sql in self.QUERIES.items()
+                   if name != 'get_events_between_datetimes'}
+        for field in self.TIMING_COLUMNS:
+            queries[f'get_events_between_datetimes({field})'] = (
+                self.QUERIES['get_events_between_datetimes'].format(field=field), ('', ''))
+        return check_query_plans(self.conn, queries)
 
-        sql = f'''
-            INSERT INTO maintenance_events ({columns})
-            VALUES ({placeholders})
-            ON CONFLICT(event_id) DO UPDATE SET
-            {updates}
-        '''
+    def upsert_event(self, event):
+        with self.transaction():
+            self.conn.execute(upsert_sql('maintenance_events', event, ('event_id',)), event)
 
-        with self.conn:
-            self.conn.execute(sql, event)
+    def upsert_many(self, events):
+        """Upsert events in one transaction, one executemany per run of events with the same columns."""
+        events = list(events)
+        with self.transaction(len(events)):
+            for columns, group in itertools.groupby(events, key=frozenset):
+                self.conn.executemany(upsert_sql('maintenance_events', columns, ('event_id',)), group)
 
     def get_event_by_id(self, event_id):
         cur = self.conn.cursor()
-        cur.execute('SELECT * FROM maintenance_events WHERE event_id = ?', (event_id,))
+        cur.execute(self.QUERIES['get_event_by_id'], (event_id,))
         return cur.fetchone()
 
     def get_events_by_cluster(self, cluster):
         cur = self.conn.cursor()
-        cur.execute('SELECT * FROM maintenance_events WHERE cluster = ?', (cluster,))
+        cur.execute(self.QUERIES['get_events_by_cluster'], (cluster,))
         return cur.fetchall()
 
     def get_events_by_node(self, node):
         cur = self.conn.cursor()
-        cur.execute('SELECT * FROM maintenance_events WHERE node = ?', (node,))
+        cur.execute(self.QUERIES['get_events_by_node'], (node,))
         return cur.fetchall()
 
     def get_events_between_datetimes(self, field, start_datetime, end_datetime):
-        query = f'SELECT * FROM maintenance_events WHERE {field} BETWEEN ? AND ?'
+        # field is put in the SQL, so it must be a known column
+        if field not in self.TIMING_COLUMNS:
+            raise ValueError(f'Unknown timing field {field}, use one of {self.TIMING_COLUMNS}')
+        query = self.QUERIES['get_events_between_datetimes'].format(field=field)
         cur = self.conn.cursor()
         cur.execute(query, (start_datetime, end_datetime))
         return cur.fetchall()
@@ -0,0 +1,93 @@
+import contextlib
+import logging
+import os
+import sqlite3
+
+# applied to every connection, in order (journal_mode first)
+PRAGMAS = {
+    # readers do not block the writer and a commit is an append to the -wal file
+    'journal_mode': 'WAL',
+    # with WAL only a checkpoint waits for fsync, a crash can lose the last
+    # commits but never corrupts the database
+    'synchronous': 'NORMAL',
+    # negative is KiB, 64 MiB
+    'cache_size': -64 * 1024,
+    # 256 MiB
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    # wait for a lock held by another process instead of failing at once
+    'busy_timeout': 5000,
+}
+
+# rows written per transaction in bulk()
+BULK_BATCH_SIZE = 5000
+
+
+def connect(db_location, pragmas=None, **kwargs):
+    """Open a sqlite connection with PRAGMAS applied.
+
+    pragmas overrides or adds to PRAGMAS, the other arguments are passed to
+    sqlite3.connect.
+    """
+    conn = sqlite3.connect(db_location, **kwargs)
+    for name, value in {**PRAGMAS, **(pragmas or {})}.items():
+        conn.execute(f'PRAGMA {name} = {value}')
+    return conn
+
+
+def remove_db(db_location):
+    """Delete a database with its -wal and -shm files."""
+    for suffix in ('', '-wal', '-shm'):
+        path = f'{db_location}{suffix}'
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class BulkMixin:
+    """Write transactions for a class with a conn attribute.
+
+    Writes go through transaction(), which commits each write on its own,
+    unless they are made inside bulk(), which commits every batch_size rows:
+
+        with db.bulk():
+            for event in events:
+                db.insert_event(event)
+    """
+    _bulk_batch_size = 0
+    _bulk_pending = 0
+
+    @contextlib.contextmanager
+    def transaction(self, rows=1):
+        """Run the writes of the block in a transaction, rows is how many rows they write."""
+        if not self._bulk_batch_size:
+            with self.conn:
+                yield
+            return
+        yield
+        self._bulk_pending += rows
+        if self._bulk_pending >= self._bulk_batch_size:
+            self.conn.commit()
+            self._bulk_pending = 0
+
+    @contextlib.contextmanager
+    def bulk(self, batch_size=BULK_BATCH_SIZE):
+        """Commit the writes of the block every batch_size rows instead of every write.
+
+        On an error the rows since the last commit are rolled back.
+        """
+        if self._bulk_batch_size:
+            # already in bulk, the outer block commits
+            yield self
+            return
+        self._bulk_batch_size = batch_size
+        self._bulk_pending = 0
+        try:
+            yield self
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            logging.debug(f'{type(self).__name__}: rolled back {self._bulk_pending} rows')
+            raise
+        finally:
+            self._bulk_batch_size = 0
+            self._bulk_pending = 0
@@ -0,0 +1,54 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+
+
+class DBWriter:
+    """Run database calls one at a time on a single thread.
+
+    Worker threads hand their writes (and the reads they need) to the writer,
+    so a sqlite connection is only ever used by one thread and writers never
+    wait on each other's locks. The queue is bounded so fast producers wait
+    for the writer instead of piling up data in memory.
+    """
+    def __init__(self, max_pending=256):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            future, func, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def submit(self, func, *args, **kwargs):
+        """Queue func(*args, **kwargs), returns a Future with its result."""
+        if not self.thread.is_alive():
+            raise RuntimeError('DBWriter is closed')
+        future = Future()
+        self.queue.put((future, func, args, kwargs))
+        return future
+
+    def call(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) on the writer thread and wait for its result."""
+        return self.submit(func, *args, **kwargs).result()
+
+    def flush(self):
+        """Wait until every call queued so far is done."""
+        self.call(lambda: None)
+
+    def close(self):
+        """Finish the queued calls and stop the thread."""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+            logging.debug('DBWriter: stopped')
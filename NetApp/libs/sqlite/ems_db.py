@@ -1,7 +1,12 @@
 import sqlite3
+import itertools
 import os
 from datetime import datetime
 
+from libs.sqlite.connection import BulkMixin, connect, remove_db
+from libs.sqlite.query_plan import check_query_plans
+from libs.sqlite.statements import insert_sql
+
 # Adapter to convert datetime to string
 def adapt_datetime(dt):
     return dt.isoformat()
@@ -14,7 +19,13 @@ def convert_datetime(s):
 sqlite3.register_adapter(datetime, adapt_datetime)
 sqlite3.register_converter("time", convert_datetime)
 
-class EmsEventsDB:
+class EmsEventsDB(BulkMixin):
+    INDEXED_COLUMNS = ('cluster', 'node', 'time')
+    QUERIES = {
+        'get_events_by_node': 'SELECT * FROM ems_events WHERE node = ?',
+        'get_events_between_datetimes': 'SELECT * FROM ems_events WHERE time BETWEEN ? AND ?',
+    }
+
     def __init__(self, config, db_name='ems_events.db', overwrite=True):
         db_dir = config.db_dir / 'emsevents'
         os.makedirs(db_dir, exist_ok=True)
@@ -24,10 +35,12 @@ class EmsEventsDB:
         if os.path.exists(db_location):
             self.exists = True
             if self.overwrite:
-                os.remove(db_location)
+                # the -wal and -shm files of the old database must go with it
+                remove_db(db_location)
 
-        self.conn = sqlite3.connect(db_location, detect_types=sqlite3.PARSE_DECLTYPES)
+        self.conn = connect(db_location, detect_types=sqlite3.PARSE_DECLTYPES)
         self.create_table()
+        self.create_indexes()
 
     def create_table(self):
         # Check if the table already exists
@@ -37,7 +50,7 @@ class EmsEventsDB:
         ''')
         if cur.fetchone() is None:
             # Create the table if it does not exist
-            with self.conn:
+            with self.transaction():
                 self.conn.execute('''
                     CREATE TABLE IF NOT EXISTS ems_events (
                         event_id TEXT,
@@ -50,28 +63,36 @@ class EmsEventsDB:
                     )
                 ''')
 
-    def insert_event(self, event):
-        # Dynamically create the insert string
-        columns = ', '.join(event.keys())
-        placeholders = ', '.join(f':{key}' for key in event.keys())
+    def create_indexes(self):
+        """Index the columns the get_events_* methods search, also on existing databases."""
+        with self.transaction():
+            for column in self.INDEXED_COLUMNS:
+                self.conn.execute(f'CREATE INDEX IF NOT EXISTS ems_events_{column} ON ems_events ({column})')
 
-        sql = f'''
-            INSERT INTO ems_events ({columns})
-            VALUES ({placeholders})
-        '''
+    def check_query_plans(self):
+        """Return the queries of the get_* methods that do not use an index, see query_plan.check_query_plans."""
+        return check_query_plans(self.conn, {
+            name: (sql, ('',) * sql.count('?')) for name, sql in self.QUERIES.items()})
+
+    def insert_event(self, event):
+        with self.transaction():
+            self.conn.execute(insert_sql('ems_events', event), event)
 
-        with self.conn:
-            self.conn.execute(sql, event)
+    def insert_many(self, events):
+        """Insert events in one transaction, one executemany per run of events with the same columns."""
+        events = list(events)
+        with self.transaction(len(events)):
+            for columns, group in itertools.groupby(events, key=frozenset):
+                self.conn.executemany(insert_sql('ems_events', columns), group)
 
     def get_events_by_node(self, node):
         cur = self.conn.cursor()
-        cur.execute('SELECT * FROM ems_events WHERE node = ?', (node,))
+        cur.execute(self.QUERIES['get_events_by_node'], (node,))
         return cur.fetchall()
 
     def get_events_between_datetimes(self, start_datetime, end_datetime):
-        query = 'SELECT * FROM ems_events WHERE time BETWEEN ? AND ?'
         cur = self.conn.cursor()
-        cur.execute(query, (start_datetime, end_datetime))
+        cur.execute(self.QUERIES['get_events_between_datetimes'], (start_datetime, end_datetime))
         return cur.fetchall()
 
 # # Example usage
@@ -1,8 +1,14 @@
 import sqlite3
+import json
 import logging
+import pathlib
 import pprint
+import re
 from datetime import datetime
 
+from libs.sqlite.connection import BulkMixin, connect
+from libs.sqlite.statements import upsert_sql
+
 # Adapter to convert datetime to string
 def adapt_datetime(dt):
     return dt.isoformat()
@@ -15,13 +21,43 @@ def convert_datetime(s):
 sqlite3.register_adapter(datetime, adapt_datetime)
 sqlite3.register_converter("timestamp", convert_datetime)
 
-class MetricDB:
-    def __init__(self, config, db_name='metrics.db'):
+# {cluster}_{date}_metrics.db, the MetricDB of a cluster saved by dump_cluster_metrics_dii
+DB_NAME_RE = re.compile(r'(?P<cluster>.+)_(?P<date>\d{4}-\d{2}-\d{2})_metrics\.db')
+
+# the metrics saved for every volume
+METRIC_COLUMNS = ('read_ops', 'write_ops', 'read_latency', 'write_latency',
+                  'read_throughput', 'write_throughput')
+
+class MetricDB(BulkMixin):
+    """One table per volume named "{vserver}-{volume}".
+
+    The gaps and rollups tables identify a volume by its table name, the
+    key of a volume in every method taking a key.
+    """
+    # the columns identifying a volume in the gaps and rollups tables
+    KEY_COLUMNS = ('table_name',)
+    TABLE_OPTIONS = ''
+
+    def __init__(self, config, db_name='metrics.db', check_same_thread=True):
         self.db_location = config.db_dir / db_name
-        self.conn = sqlite3.connect(self.db_location, detect_types=sqlite3.PARSE_DECLTYPES)
+        # check_same_thread=False when the connection is handed to a DBWriter thread
+        self.conn = connect(self.db_location, detect_types=sqlite3.PARSE_DECLTYPES,
+                            check_same_thread=check_same_thread)
         self.conn.row_factory = sqlite3.Row  # Enables dictionary-like access        
         # self.create_table()
 
+    def volume_key(self, cluster, vserver, volume):
+        """Return the key of a volume for the other methods."""
+        return f'{vserver}-{volume}'
+
+    def key_values(self, key):
+        """Return the KEY_COLUMNS of a volume as a dict."""
+        return {'table_name': key}
+
+    def key_filter(self):
+        """Return the WHERE clause matching the named key values of a volume."""
+        return ' AND '.join(f'{column} = :{column}' for column in self.KEY_COLUMNS)
+
     def create_table(self, table_name):
         # Check if the table already exists
         cur = self.conn.cursor()
@@ -41,39 +77,266 @@ class MetricDB:
                         write_throughput REAL
                     )
                 '''
-            with self.conn:
+            with self.transaction():
                 self.conn.execute(sql)
 
+    def get_last_timestamp(self, table_name):
+        """Return the newest timestamp (epoch seconds) in a table, None if it is empty or missing."""
+        cur = self.conn.cursor()
+        cur.execute('SELECT name FROM sqlite_master WHERE type="table" AND name=?', (table_name,))
+        if cur.fetchone() is None:
+            return None
+        cur.execute(f'SELECT MAX(CAST(timestamp AS INTEGER)) FROM "{table_name}"')
+        return cur.fetchone()[0]
+
+    def save_gaps(self, key, gaps, since=None):
+        """Replace the gaps of a volume found since a timestamp.
+
+        gaps is a list of dicts with metric, start, end and count.
+        """
+        key_values = self.key_values(key)
+        key_defs = ', '.join(f'{column} TEXT' for column in self.KEY_COLUMNS)
+        key_columns = ', '.join(self.KEY_COLUMNS)
+        key_placeholders = ', '.join(f':{column}' for column in self.KEY_COLUMNS)
+        with self.transaction(len(gaps)):
+            self.conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS metric_gaps (
+                    {key_defs},
+                    metric TEXT,
+                    start INTEGER,
+                    end INTEGER,
+                    count INTEGER,
+                    PRIMARY KEY ({key_columns}, metric, start)
+                ){self.TABLE_OPTIONS}
+            ''')
+            self.conn.execute(f'DELETE FROM metric_gaps WHERE {self.key_filter()} AND start >= :since',
+                              {**key_values, 'since': since or 0})
+            self.conn.executemany(f'''
+                INSERT OR REPLACE INTO metric_gaps ({key_columns}, metric, start, end, count)
+                VALUES ({key_placeholders}, :metric, :start, :end, :count)
+            ''', [{**key_values, **gap} for gap in gaps])
+
+    def get_volume_tables(self):
+        """Return the names of the raw per volume tables."""
+        cur = self.conn.cursor()
+        cur.execute('SELECT name FROM sqlite_master WHERE type="table" AND name NOT LIKE "sqlite_%"')
+        return [row['name'] for row in cur.fetchall()
+                if row['name'] != 'metric_gaps' and not row['name'].startswith('rollup_')]
+
+    def get_volume_keys(self):
+        """Return the keys of the volumes with raw rows."""
+        return self.get_volume_tables()
+
+    def get_columns(self, table_name):
+        cur = self.conn.cursor()
+        cur.execute(f'PRAGMA table_info("{table_name}")')
+        return [row['name'] for row in cur.fetchall()]
+
+    def get_metric_columns(self, key):
+        """Return the metric columns of the raw rows of a volume."""
+        return [column for column in self.get_columns(key) if column != 'timestamp']
+
+    def get_rows(self, table_name, since=None):
+        """Return the rows of a table from the timestamp since on, oldest first."""
+        cur = self.conn.cursor()
+        cur.execute(f'''
+            SELECT * FROM "{table_name}"
+            WHERE CAST(timestamp AS INTEGER) >= ?
+            ORDER BY CAST(timestamp AS INTEGER)
+        ''', (since or 0,))
+        return cur.fetchall()
+
+    def create_rollup_table(self, resolution, columns):
+        """Create rollup_{resolution} holding the aggregates of every volume."""
+        key_defs = ', '.join(f'{column} TEXT' for column in self.KEY_COLUMNS)
+        column_defs = ', '.join(f'{column} REAL' for column in columns)
+        with self.transaction():
+            self.conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS "rollup_{resolution}" (
+                    {key_defs},
+                    timestamp INTEGER,
+                    {column_defs},
+                    PRIMARY KEY ({', '.join(self.KEY_COLUMNS)}, timestamp)
+                ){self.TABLE_OPTIONS}
+            ''')
+
+    def get_last_rollup(self, resolution, key):
+        """Return the start of the newest rollup bucket of a volume, None if there is none."""
+        cur = self.conn.cursor()
+        cur.execute(f'SELECT MAX(timestamp) FROM "rollup_{resolution}" WHERE {self.key_filter()}',
+                    self.key_values(key))
+        return cur.fetchone()[0]
+
+    def upsert_rollup(self, resolution, key, records):
+        if not records:
+            return
+        key_values = self.key_values(key)
+        sql = upsert_sql(f'rollup_{resolution}', [*key_values, *records[0].keys()],
+                         (*self.KEY_COLUMNS, 'timestamp'))
+        with self.transaction(len(records)):
+            self.conn.executemany(sql, [{**key_values, **record} for record in records])
+
+    def prune(self, table_name, before):
+        """Delete the rows of a table older than the timestamp before, returns the number deleted."""
+        with self.transaction():
+            cur = self.conn.execute(f'DELETE FROM "{table_name}" WHERE CAST(timestamp AS INTEGER) < ?',
+                                    (before,))
+        return cur.rowcount
+
     def upsert_data(self, table_name, data):
-        # Dynamically create the insert string
-        columns = ', '.join(data.keys())
-        placeholders = ', '.join(f':{key}' for key in data.keys())
-        updates = ', '.join(f'{key}=excluded.{key}' for key in data.keys())
-
-        sql = f'''
-            INSERT INTO "{table_name}" ({columns})
-            VALUES ({placeholders})
-            ON CONFLICT(timestamp) DO UPDATE SET
-            {updates}
-        '''
-
-        with self.conn:
+        sql = upsert_sql(table_name, data.keys(), ('timestamp',))
+        with self.transaction():
             self.conn.execute(sql, data)
 
     def upsert_many(self, table_name, all_data: list):
-        columns = list(all_data[0].keys())
-        # pprint.pprint(columns)
-        placeholders = ', '.join(f':{key}' for key in columns)
-        updates = ', '.join(f'{key}=excluded.{key}' for key in columns)
-
-        sql = f'''
-            INSERT INTO "{table_name}" ({', '.join(columns)})
-            VALUES ({placeholders})
-            ON CONFLICT(timestamp) DO UPDATE SET
-            {updates}
-        '''
-        with self.conn:
+        sql = upsert_sql(table_name, all_data[0].keys(), ('timestamp',))
+        with self.transaction(len(all_data)):
             self.conn.executemany(sql, all_data)
 
+class WideMetricDB(MetricDB):
+    """Every volume in one metrics table keyed by (cluster, svm, volume, timestamp).
+
+    The table is WITHOUT ROWID, so the rows of a volume are stored together in
+    primary key order and a time range of a volume is one contiguous read.
+    The schema stays the same size however many volumes there are, and
+    queries across volumes are plain SELECTs.
+    """
+    KEY_COLUMNS = ('cluster', 'svm', 'volume')
+    TABLE_OPTIONS = ' WITHOUT ROWID'
+    TABLE = 'metrics'
+
+    def __init__(self, config, db_name='wide_metrics.db', check_same_thread=True,
+                 timestamp_index=False):
+        super().__init__(config, db_name=db_name, check_same_thread=check_same_thread)
+        self.create_metrics_table(timestamp_index)
+
+    def create_metrics_table(self, timestamp_index=False):
+        """Create the metrics table, the primary key covers the queries of one volume.
+
+        timestamp_index adds an index for time ranges across every volume, it
+        makes inserts several times slower, see benchmark_metrics_db.py.
+        """
+        metric_defs = ', '.join(f'{column} REAL' for column in METRIC_COLUMNS)
+        with self.transaction():
+            self.conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS {self.TABLE} (
+                    cluster TEXT,
+                    svm TEXT,
+                    volume TEXT,
+                    timestamp INTEGER,
+                    {metric_defs},
+                    PRIMARY KEY (cluster, svm, volume, timestamp)
+                ) WITHOUT ROWID
+            ''')
+            if timestamp_index:
+                # the entries of an index on a WITHOUT ROWID table hold the primary
+                # key, so this covers finding the volumes with data in a time range
+                self.conn.execute(f'''
+                    CREATE INDEX IF NOT EXISTS {self.TABLE}_timestamp
+                    ON {self.TABLE} (timestamp)
+                ''')
+
+    def volume_key(self, cluster, vserver, volume):
+        return (cluster, vserver, volume)
+
+    def key_values(self, key):
+        return dict(zip(self.KEY_COLUMNS, key))
+
+    def create_table(self, key):
+        """Nothing to do, every volume is in the metrics table."""
+
+    def get_last_timestamp(self, key):
+        """Return the newest timestamp (epoch seconds) of a volume, None if it has no rows."""
+        cur = self.conn.cursor()
+        cur.execute(f'SELECT MAX(timestamp) FROM {self.TABLE} WHERE {self.key_filter()}',
+                    self.key_values(key))
+        return cur.fetchone()[0]
+
+    def get_volume_keys(self):
+        cur = self.conn.cursor()
+        cur.execute(f'SELECT DISTINCT cluster, svm, volume FROM {self.TABLE}')
+        return [tuple(row) for row in cur.fetchall()]
+
+    def get_metric_columns(self, key):
+        return [column for column in self.get_columns(self.TABLE)
+                if column not in self.KEY_COLUMNS and column != 'timestamp']
+
+    def get_rows(self, key, since=None):
+        """Return the rows of a volume from the timestamp since on, oldest first."""
+        columns = ', '.join(['timestamp', *self.get_metric_columns(key)])
+        cur = self.conn.cursor()
+        cur.execute(f'''
+            SELECT {columns} FROM {self.TABLE}
+            WHERE {self.key_filter()} AND timestamp >= :since
+            ORDER BY timestamp
+        ''', {**self.key_values(key), 'since': since or 0})
+        return cur.fetchall()
+
+    def get_rows_between(self, start, end):
+        """Return the rows of every volume with start <= timestamp < end."""
+        cur = self.conn.cursor()
+        cur.execute(f'SELECT * FROM {self.TABLE} WHERE timestamp >= ? AND timestamp < ?',
+                    (start, end))
+        return cur.fetchall()
+
+    def prune(self, key, before):
+        with self.transaction():
+            cur = self.conn.execute(f'DELETE FROM {self.TABLE} WHERE {self.key_filter()} AND timestamp < :before',
+                                    {**self.key_values(key), 'before': before})
+        return cur.rowcount
+
+    def upsert_data(self, key, data):
+        self.upsert_many(key, [data])
+
+    def upsert_many(self, key, all_data: list):
+        key_values = self.key_values(key)
+        sql = upsert_sql(self.TABLE, [*key_values, *all_data[0].keys()],
+                         (*self.KEY_COLUMNS, 'timestamp'))
+        with self.transaction(len(all_data)):
+            self.conn.executemany(sql, [{**key_values, **data} for data in all_data])
+
+
+def is_wide_db(db_location):
+    """Check if an existing database file holds a WideMetricDB."""
+    if not pathlib.Path(db_location).exists():
+        return False
+    conn = sqlite3.connect(db_location)
+    try:
+        cur = conn.execute('SELECT name FROM sqlite_master WHERE type="table" AND name=?',
+                           (WideMetricDB.TABLE,))
+        return cur.fetchone() is not None
+    finally:
+        conn.close()
+
+
+def load_volume_names(inventory_file):
+    """Return "{vserver}-{volume}" -> (vserver, volume) from a volume inventory of dump_cluster_metrics_dii."""
+    inventory_file = pathlib.Path(inventory_file)
+    if not inventory_file.exists():
+        logging.warning(f'No volume inventory {inventory_file}')
+        return {}
+    return {f"{volume['svm']['name']}-{volume['name']}": (volume['svm']['name'], volume['name'])
+            for volume in json.loads(inventory_file.read_text())}
+
+
+def split_table_name(table_name, volume_names):
+    """Return the (vserver, volume) of a MetricDB table.
+
+    volume_names is from load_volume_names, other names are split at the
+    first "-", which is wrong when the svm name has a "-" in it.
+    """
+    if table_name in volume_names:
+        return volume_names[table_name]
+    vserver, _, volume = table_name.partition('-')
+    logging.warning(f'  {table_name} is not in the inventory, using {vserver}/{volume}')
+    return vserver, volume
+
+
+def open_metric_db(config, db_name, **kwargs):
+    """Open a metrics database with the class matching how it stores the volumes."""
+    if is_wide_db(config.db_dir / db_name):
+        return WideMetricDB(config, db_name=db_name, **kwargs)
+    return MetricDB(config, db_name=db_name, **kwargs)
+
 # # Example usage
 # db = MaintenanceDB()
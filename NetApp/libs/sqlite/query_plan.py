@@ -0,0 +1,21 @@
+import logging
+
+
+def query_plan(conn, sql, params=()):
+    """Return the detail lines of EXPLAIN QUERY PLAN for a query."""
+    return [row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+
+
+def check_query_plans(conn, queries):
+    """Find the queries that read a whole table or index instead of searching it.
+
+    queries is a dict of name -> (sql, params), returns name -> plan of the
+    queries that scan and logs a warning for each.
+    """
+    scans = {}
+    for name, (sql, params) in queries.items():
+        plan = query_plan(conn, sql, params)
+        if any(detail.startswith('SCAN') for detail in plan):
+            logging.warning(f'{name} scans instead of using an index: {"; ".join(plan)}')
+            scans[name] = plan
+    return scans
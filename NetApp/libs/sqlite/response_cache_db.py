@@ -0,0 +1,120 @@
+import sqlite3
+import os
+import threading
+import time
+import logging
+
+from libs.sqlite.connection import connect
+
+# 256 MiB
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# access times kept in memory before they are written
+ACCESS_FLUSH_SIZE = 1000
+
+class ResponseCacheDB:
+    """On disk cache of API GET responses, evicting the least recently used.
+
+    The cache lives in data/cache so it is shared by every script.
+    """
+    def __init__(self, config, db_name='response_cache.db', max_bytes=DEFAULT_MAX_BYTES):
+        db_dir = config.data_dir.parent / 'cache'
+        os.makedirs(db_dir, exist_ok=True)
+        self.db_location = db_dir / db_name
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'revalidated': 0, 'misses': 0, 'evicted': 0}
+        # used from the worker threads of AsyncAPIWrapper
+        self.lock = threading.Lock()
+        # url -> last access, a hit does not write, see flush_access
+        self.accessed = {}
+        self.conn = connect(self.db_location, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row  # Enables dictionary-like access
+        self.create_table()
+
+    def create_table(self):
+        with self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    url TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    body BLOB,
+                    size INTEGER,
+                    stored_at REAL,
+                    accessed_at REAL
+                )
+            ''')
+            self.conn.execute('''
+                CREATE INDEX IF NOT EXISTS responses_accessed_at
+                ON responses (accessed_at)
+            ''')
+
+    def get(self, url):
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute('SELECT * FROM responses WHERE url = ?', (url,))
+            row = cur.fetchone()
+            if row is not None:
+                self.accessed[url] = time.time()
+                if len(self.accessed) >= ACCESS_FLUSH_SIZE:
+                    self.flush_access()
+            return row
+
+    def put(self, url, body, etag=None, last_modified=None):
+        now = time.time()
+        with self.lock:
+            with self.conn:
+                self.conn.execute('''
+                    INSERT INTO responses (url, etag, last_modified, body, size, stored_at, accessed_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(url) DO UPDATE SET
+                    etag=excluded.etag, last_modified=excluded.last_modified, body=excluded.body,
+                    size=excluded.size, stored_at=excluded.stored_at, accessed_at=excluded.accessed_at
+                ''', (url, etag, last_modified, body, len(body), now, now))
+            self.accessed.pop(url, None)
+            self.evict()
+
+    def touch(self, url):
+        """Mark a response as fresh again after the server confirmed it is unchanged."""
+        now = time.time()
+        with self.lock:
+            with self.conn:
+                self.conn.execute('UPDATE responses SET stored_at = ?, accessed_at = ? WHERE url = ?',
+                                  (now, now, url))
+            self.accessed.pop(url, None)
+
+    def flush_access(self):
+        """Write the access times of the hits since the last flush, called with the lock held."""
+        if not self.accessed:
+            return
+        with self.conn:
+            self.conn.executemany('UPDATE responses SET accessed_at = ? WHERE url = ?',
+                                  [(accessed_at, url) for url, accessed_at in self.accessed.items()])
+        self.accessed = {}
+
+    def evict(self):
+        """Delete the least recently used responses until the cache fits in max_bytes."""
+        self.flush_access()
+        cur = self.conn.cursor()
+        cur.execute('SELECT COALESCE(SUM(size), 0) FROM responses')
+        total = cur.fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        to_delete = []
+        cur.execute('SELECT url, size FROM responses ORDER BY accessed_at')
+        for row in cur:
+            if total <= self.max_bytes:
+                break
+            to_delete.append((row['url'],))
+            total -= row['size']
+
+        with self.conn:
+            self.conn.executemany('DELETE FROM responses WHERE url = ?', to_delete)
+        self.stats['evicted'] += len(to_delete)
+        logging.debug(f'ResponseCacheDB: evicted {len(to_delete)} responses')
+
+    def clear(self):
+        with self.lock:
+            with self.conn:
+                self.conn.execute('DELETE FROM responses')
+            self.accessed = {}
@@ -0,0 +1,35 @@
+import functools
+
+# the most statement shapes kept, MetricDB has a table per volume
+MAX_STATEMENTS = 4096
+
+
+def insert_sql(table, columns):
+    """Return the INSERT statement for rows with these columns.
+
+    The rows are bound by name, so the columns are sorted and every row with
+    the same columns, in any order, gets the same statement text and reuses
+    the statement prepared by sqlite3.
+    """
+    return _build(table, frozenset(columns), None)
+
+
+def upsert_sql(table, columns, conflict):
+    """Return the INSERT ... ON CONFLICT DO UPDATE statement for rows with these columns.
+
+    conflict is the primary key columns, the other columns are updated.
+    """
+    return _build(table, frozenset(columns), tuple(conflict))
+
+
+@functools.lru_cache(maxsize=MAX_STATEMENTS)
+def _build(table, columns, conflict):
+    columns = sorted(columns)
+    placeholders = ', '.join(f':{column}' for column in columns)
+    sql = f'INSERT INTO "{table}" ({", ".join(columns)}) VALUES ({placeholders})'
+    if conflict is None:
+        return sql
+    updates = ', '.join(f'{column}=excluded.{column}' for column in columns
+                        if column not in conflict)
+    action = f'DO UPDATE SET {updates}' if updates else 'DO NOTHING'
+    return f'{sql} ON CONFLICT({", ".join(conflict)}) {action}'
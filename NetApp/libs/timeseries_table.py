@@ -0,0 +1,368 @@
+"""Columnar storage for the timeseries of one object (a volume).
+
+The series of every metric are aligned on one sorted array of timestamps with
+a float64 column per metric, NaN where a metric has no point.
+
+>>> table = TimeseriesTable.from_series(
+...     {
+...         "read_ops": {"timeseries": [{"time": 60000, "value": 1}]},
+...         "write_ops": {"timeseries": [{"time": 0, "value": 2}]},
+...     }
+... )
+>>> table.timestamps.tolist()
+[0, 60]
+>>> table.to_records()
+[{'timestamp': 0, 'read_ops': None, 'write_ops': 2.0}, \
+{'timestamp': 60, 'read_ops': 1.0, 'write_ops': None}]
+"""
+
+import warnings
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+# how fill_gaps fills the gaps of a column
+FILL_POLICIES = ("none", "zero", "previous", "linear")
+
+# the aggregates of every metric computed by resample
+ROLLUP_STATS = ("min", "avg", "max", "p95")
+
+
+class TimeseriesTable:
+    """Timestamps (epoch seconds) and one float64 column per metric."""
+
+    def __init__(self, timestamps: np.ndarray, columns: Dict[str, np.ndarray]):
+        """Initialize the class.
+
+        :param timestamps: sorted unique epoch seconds
+        :type timestamps: np.ndarray
+        :param columns: metric -> values aligned with timestamps, NaN for gaps
+        :type columns: Dict[str, np.ndarray]
+        """
+        self.timestamps = timestamps
+        self.columns = columns
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    @classmethod
+    def from_series(
+        cls, series: Dict[str, Any], metrics: Optional[Iterable[str]] = None
+    ) -> "TimeseriesTable":
+        """Align the DII series of several metrics on their timestamps.
+
+        Points without a numeric value are gaps.
+
+        :param series: metric -> a series with a "timeseries" list of
+            {"time": epoch ms, "value": value}, or None
+        :type series: Dict[str, Any]
+        :param metrics: the columns of the table, metrics without a series
+            are all gaps, defaults to the keys of series
+        :type metrics: Optional[Iterable[str]]
+        """
+        metrics = list(series if metrics is None else metrics)
+        times = {}
+        values = {}
+        for metric in metrics:
+            points = (series.get(metric) or {}).get("timeseries") or []
+            times[metric] = np.fromiter(
+                (point["time"] // 1000 for point in points),
+                dtype=np.int64,
+                count=len(points),
+            )
+            values[metric] = np.fromiter(
+                (_to_float(point.get("value")) for point in points),
+                dtype=np.float64,
+                count=len(points),
+            )
+
+        if times:
+            timestamps = np.unique(np.concatenate(list(times.values())))
+        else:
+            timestamps = np.empty(0, dtype=np.int64)
+        columns = {}
+        for metric in metrics:
+            column = np.full(len(timestamps), np.nan)
+            column[np.searchsorted(timestamps, times[metric])] = values[metric]
+            columns[metric] = column
+        return cls(timestamps, columns)
+
+    @classmethod
+    def from_results(
+        cls, results: Dict[str, Any], metrics: Optional[Iterable[str]] = None
+    ) -> "TimeseriesTable":
+        """Align the first series of every metric of a DII timeseries query.
+
+        A metric without data ([]) is all gaps. A metric whose query failed
+        (None) raises ValueError, its points are unknown rather than missing.
+
+        >>> TimeseriesTable.from_results(
+        ...     {
+        ...         "read_ops": [{"timeseries": [{"time": 0, "value": 1}]}],
+        ...         "write_ops": [],
+        ...     }
+        ... ).to_records()
+        [{'timestamp': 0, 'read_ops': 1.0, 'write_ops': None}]
+        >>> TimeseriesTable.from_results({"read_ops": [], "write_ops": None})
+        Traceback (most recent call last):
+        ...
+        ValueError: the query failed for write_ops
+
+        :param results: metric -> the list of series of the metric, or None
+        :type results: Dict[str, Any]
+        :param metrics: the columns of the table, defaults to the keys of results
+        :type metrics: Optional[Iterable[str]]
+        """
+        _check_results(results)
+        return cls.from_series(
+            {metric: (result or [None])[0] for metric, result in results.items()},
+            metrics,
+        )
+
+    @classmethod
+    def from_records(
+        cls, records: Iterable[Dict[str, Any]], metrics: Iterable[str]
+    ) -> "TimeseriesTable":
+        """Build a table from rows with a timestamp and the metrics, like MetricDB rows.
+
+        :param records: rows sorted by timestamp, None values are gaps
+        :type records: Iterable[Dict[str, Any]]
+        :param metrics: the columns of the table
+        :type metrics: Iterable[str]
+        """
+        records = list(records)
+        timestamps = np.fromiter(
+            (int(record["timestamp"]) for record in records),
+            dtype=np.int64,
+            count=len(records),
+        )
+        columns = {
+            metric: np.fromiter(
+                (_to_float(record[metric]) for record in records),
+                dtype=np.float64,
+                count=len(records),
+            )
+            for metric in metrics
+        }
+        return cls(timestamps, columns)
+
+    def values(self) -> np.ndarray:
+        """Return a 2d array, one row per timestamp and one column per metric."""
+        if not self.columns:
+            return np.empty((len(self.timestamps), 0))
+        return np.column_stack(list(self.columns.values()))
+
+    def missing(self) -> np.ndarray:
+        """Return a bool mask of the gaps, shaped like values()."""
+        return np.isnan(self.values())
+
+    def drop_empty_rows(self) -> "TimeseriesTable":
+        """Return a table without the timestamps where every metric is a gap."""
+        keep = ~self.missing().all(axis=1)
+        if keep.all():
+            return self
+        return TimeseriesTable(
+            self.timestamps[keep],
+            {metric: column[keep] for metric, column in self.columns.items()},
+        )
+
+    def reindex(self, interval: int, start: int, end: int) -> "TimeseriesTable":
+        """Return a table with a row for every interval in [start, end).
+
+        The added timestamps are gaps in every metric, existing timestamps
+        are kept even if they are off the grid.
+
+        :param interval: the seconds between points
+        :type interval: int
+        :param start: the first expected timestamp
+        :type start: int
+        :param end: the end of the range, excluded
+        :type end: int
+        """
+        timestamps = np.union1d(
+            self.timestamps, np.arange(start, end, interval, dtype=np.int64)
+        )
+        if len(timestamps) == len(self.timestamps):
+            return self
+        positions = np.searchsorted(timestamps, self.timestamps)
+        columns = {}
+        for metric, column in self.columns.items():
+            columns[metric] = np.full(len(timestamps), np.nan)
+            columns[metric][positions] = column
+        return TimeseriesTable(timestamps, columns)
+
+    def find_gaps(self) -> List[Dict[str, Any]]:
+        """Return the runs of consecutive gaps of every metric.
+
+        :return: one dict per run with the metric, the first and last missing
+            timestamp and the number of missing points
+        :rtype: List[Dict[str, Any]]
+        """
+        gaps = []
+        for metric, column in self.columns.items():
+            starts, ends = _gap_runs(np.isnan(column))
+            for first, last in zip(starts.tolist(), ends.tolist()):
+                gaps.append(
+                    {
+                        "metric": metric,
+                        "start": int(self.timestamps[first]),
+                        "end": int(self.timestamps[last - 1]),
+                        "count": last - first,
+                    }
+                )
+        return gaps
+
+    def fill_gaps(self, policy: str = "none", max_points: int = 0) -> "TimeseriesTable":
+        """Return a table with the gaps filled.
+
+        Only the gaps between two values are filled, the points before the
+        first and after the last value may not have been collected yet.
+
+        :param policy: none, zero, previous (repeat the last value) or linear
+            (interpolate between the values around the gap)
+        :type policy: str
+        :param max_points: only fill gaps of at most this many points, 0 to
+            fill every gap
+        :type max_points: int
+        """
+        if policy not in FILL_POLICIES:
+            raise ValueError(
+                f"Unknown fill policy {policy}, use one of {FILL_POLICIES}"
+            )
+        if policy == "none":
+            return self
+
+        columns = {}
+        for metric, column in self.columns.items():
+            missing = np.isnan(column)
+            present = np.flatnonzero(~missing)
+            to_fill = np.zeros(len(column), dtype=bool)
+            if len(present):
+                to_fill[present[0] : present[-1]] = missing[present[0] : present[-1]]
+            if max_points:
+                starts, ends = _gap_runs(missing)
+                for first, last in zip(starts.tolist(), ends.tolist()):
+                    if last - first > max_points:
+                        to_fill[first:last] = False
+            if not to_fill.any():
+                columns[metric] = column
+                continue
+
+            if policy == "zero":
+                values = np.zeros(len(column))
+            elif policy == "previous":
+                # index of the last present value at or before every row
+                last = np.maximum.accumulate(
+                    np.where(missing, 0, np.arange(len(column)))
+                )
+                values = column[last]
+            else:
+                values = np.interp(
+                    self.timestamps, self.timestamps[present], column[present]
+                )
+            columns[metric] = np.where(to_fill, values, column)
+        return TimeseriesTable(self.timestamps, columns)
+
+    def resample(self, seconds: int) -> "TimeseriesTable":
+        """Aggregate the table into buckets of seconds.
+
+        Every metric becomes the {metric}_min, _avg, _max and _p95 columns,
+        gaps are ignored. The timestamps are the start of the buckets.
+
+        :param seconds: the size of the buckets
+        :type seconds: int
+        """
+        if not len(self.timestamps):
+            return TimeseriesTable(
+                self.timestamps,
+                {
+                    f"{metric}_{stat}": np.empty(0)
+                    for metric in self.columns
+                    for stat in ROLLUP_STATS
+                },
+            )
+        buckets = self.timestamps - self.timestamps % seconds
+        starts, first_rows = np.unique(buckets, return_index=True)
+        # lay every bucket out as a row of a 2d array padded with NaN, so the
+        # aggregates are computed for all the buckets at once
+        group = np.searchsorted(starts, buckets)
+        offset = np.arange(len(buckets)) - first_rows[group]
+        width = int(offset.max()) + 1
+
+        columns = {}
+        with warnings.catch_warnings():
+            # buckets where a metric only has gaps are NaN
+            warnings.simplefilter("ignore", RuntimeWarning)
+            for metric, column in self.columns.items():
+                grid = np.full((len(starts), width), np.nan)
+                grid[group, offset] = column
+                columns[f"{metric}_min"] = np.nanmin(grid, axis=1)
+                columns[f"{metric}_avg"] = np.nanmean(grid, axis=1)
+                columns[f"{metric}_max"] = np.nanmax(grid, axis=1)
+                columns[f"{metric}_p95"] = np.nanpercentile(grid, 95, axis=1)
+        return TimeseriesTable(starts, columns)
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        """Return one dict per timestamp for MetricDB, gaps are None."""
+        names = ["timestamp", *self.columns]
+        columns = [self.timestamps.tolist()]
+        for column in self.columns.values():
+            columns.append(np.where(np.isnan(column), None, column).tolist())
+        return [dict(zip(names, row)) for row in zip(*columns)]
+
+
+def _gap_runs(missing: np.ndarray):
+    """Return the start and end (excluded) indexes of the runs of True in missing."""
+    edges = np.diff(np.concatenate(([0], missing.astype(np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def _check_results(results: Dict[str, Any]) -> None:
+    """Raise ValueError if the query of a metric failed, its result is None."""
+    failed = [metric for metric, result in results.items() if result is None]
+    if failed:
+        raise ValueError(f"the query failed for {', '.join(failed)}")
+
+
+def _to_float(value: Any) -> float:
+    """Convert a point value to float, NaN if it is missing or not a number."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def tables_by_tags(
+    results: Dict[str, Any],
+    tag_names: Iterable[str],
+    metrics: Optional[Iterable[str]] = None,
+) -> Dict[tuple, TimeseriesTable]:
+    """Split the results of timeseries.post into one table per object.
+
+    The first series of a metric for an object is kept, like a per object
+    query would. Raises ValueError if the query of a metric failed.
+
+    :param results: metric -> list of series with a "tagSet"
+    :type results: Dict[str, Any]
+    :param tag_names: the tags identifying an object, like
+        ("vserver_name", "volume_name")
+    :type tag_names: Iterable[str]
+    :param metrics: the columns of the tables, defaults to the keys of results
+    :type metrics: Optional[Iterable[str]]
+    :return: tag values -> table
+    :rtype: Dict[tuple, TimeseriesTable]
+    """
+    _check_results(results)
+    tag_names = tuple(tag_names)
+    series_by_key: Dict[tuple, Dict[str, Any]] = {}
+    for metric, series_list in results.items():
+        for series in series_list:
+            tags = series.get("tagSet", {})
+            key = tuple(tags.get(name) for name in tag_names)
+            series_by_key.setdefault(key, {}).setdefault(metric, series)
+
+    metrics = list(results if metrics is None else metrics)
+    return {
+        key: TimeseriesTable.from_series(series, metrics)
+        for key, series in series_by_key.items()
+    }
@@ -0,0 +1,209 @@
+"""Copy the per volume tables of the metrics databases saved by
+dump_cluster_metrics_dii into the single metrics table of a WideMetricDB.
+
+The raw rows, the metric_gaps and the rollup tables are copied, the source
+database is left as is.
+
+A table named "{vserver}-{volume}" is split using the volume inventory saved
+by dump_cluster_metrics_dii, names that are not in it are split at the first
+"-", which is wrong when the svm name has a "-" in it.
+"""
+
+import logging
+import pathlib
+
+from libs.config import Config
+from libs.log import setup_logger
+from libs.parseargs import argp
+from libs.sqlite.metrics_db import (
+    DB_NAME_RE,
+    MetricDB,
+    WideMetricDB,
+    is_wide_db,
+    load_volume_names,
+    split_table_name,
+)
+
+script_name = pathlib.Path(__file__).stem
+
+setup_logger(script_name)
+
+
+def migrate_db(
+    source: MetricDB, target: WideMetricDB, cluster: str, volume_names: dict
+) -> int:
+    """Copy the volumes of a cluster from a MetricDB to a WideMetricDB.
+
+    :param source: the per volume tables
+    :type source: MetricDB
+    :param target: the database to copy to
+    :type target: WideMetricDB
+    :param cluster: the cluster of the volumes
+    :type cluster: str
+    :param volume_names: "{vserver}-{volume}" -> (vserver, volume)
+    :type volume_names: dict
+    :return: the number of raw rows copied
+    :rtype: int
+    """
+    keys = {}
+
+    def key_of(table_name: str):
+        if table_name not in keys:
+            keys[table_name] = target.volume_key(
+                cluster, *split_table_name(table_name, volume_names)
+            )
+        return keys[table_name]
+
+    copied = 0
+    volume_tables = source.get_volume_tables()
+    for table_name in volume_tables:
+        records = [
+            {**dict(row), "timestamp": int(row["timestamp"])}
+            for row in source.get_rows(table_name)
+        ]
+        if records:
+            target.upsert_many(key_of(table_name), records)
+            copied += len(records)
+
+    tables = {
+        row["name"]
+        for row in source.conn.execute(
+            'SELECT name FROM sqlite_master WHERE type="table"'
+        )
+    }
+    if "metric_gaps" in tables:
+        gaps = {}
+        for row in source.conn.execute("SELECT * FROM metric_gaps"):
+            gap = dict(row)
+            gaps.setdefault(gap.pop("table_name"), []).append(gap)
+        for table_name, volume_gaps in gaps.items():
+            target.save_gaps(key_of(table_name), volume_gaps)
+
+    for rollup in sorted(name for name in tables if name.startswith("rollup_")):
+        resolution = rollup.removeprefix("rollup_")
+        columns = [
+            column
+            for column in source.get_columns(rollup)
+            if column not in ("table_name", "timestamp")
+        ]
+        target.create_rollup_table(resolution, columns)
+        records = {}
+        for row in source.conn.execute(f'SELECT * FROM "{rollup}" ORDER BY timestamp'):
+            record = dict(row)
+            records.setdefault(record.pop("table_name"), []).append(record)
+        for table_name, volume_records in records.items():
+            target.upsert_rollup(resolution, key_of(table_name), volume_records)
+
+    logging.info(
+        f"Copied {copied} rows of {len(volume_tables)} volumes from {source.db_location}"
+        f" to {target.db_location}"
+    )
+    return copied
+
+
+if __name__ == "__main__":
+    args = argp(
+        script_name=script_name,
+        description=(
+            "copy the per volume tables of metrics databases into the single"
+            " metrics table of a wide metrics database"
+        ),
+        parse=False,
+    )
+    args.parser.add_argument(
+        "-i",
+        "--inputfile",
+        type=str,
+        help=(
+            "{cluster}_{date}_metrics.db file, default: every per volume metrics"
+            " db in the db directory"
+        ),
+        default="",
+    )
+    args.parser.add_argument(
+        "--db_dir",
+        type=str,
+        help=(
+            "the directory with the metrics databases,"
+            " default: the db directory of dump_cluster_metrics_dii"
+        ),
+        default="",
+    )
+    args.parser.add_argument(
+        "--outputfile",
+        type=str,
+        help="the wide metrics db, default: {date}_wide_metrics.db next to the input",
+        default="",
+    )
+    args.parser.add_argument(
+        "--cluster",
+        type=str,
+        help="the cluster of the volumes, default: from the input file name",
+        default="",
+    )
+    args.parser.add_argument(
+        "--inventory_dir",
+        type=str,
+        help=(
+            "the directory with the {cluster}_volumes.json inventories,"
+            " default: the data directory of dump_cluster_metrics_dii"
+        ),
+        default="",
+    )
+
+    args.parse()
+
+    config = Config(
+        args.config_dir,  # pyright: ignore[reportAttributeAccessIssue]
+        args.output_dir,  # pyright: ignore[reportAttributeAccessIssue]
+        script_name=script_name,
+        args=args,
+    )
+
+    dump_dir = config.data_dir.parent / "dump_cluster_metrics_dii"
+    if args.inputfile:  # pyright: ignore[reportAttributeAccessIssue]
+        db_files = [
+            pathlib.Path(args.inputfile)  # pyright: ignore[reportAttributeAccessIssue]
+        ]
+    else:
+        db_dir = pathlib.Path(
+            args.db_dir  # pyright: ignore[reportAttributeAccessIssue]
+            or dump_dir / "db"
+        )
+        db_files = [
+            db_file
+            for db_file in sorted(db_dir.glob("*_metrics.db"))
+            if not is_wide_db(db_file)
+        ]
+        if not db_files:
+            logging.warning(f"No per volume metrics databases in {db_dir}")
+    inventory_dir = pathlib.Path(
+        args.inventory_dir or dump_dir  # pyright: ignore[reportAttributeAccessIssue]
+    )
+
+    for db_file in db_files:
+        match = DB_NAME_RE.fullmatch(db_file.name)
+        cluster = args.cluster or (  # pyright: ignore[reportAttributeAccessIssue]
+            match and match.group("cluster")
+        )
+        if is_wide_db(db_file) or not cluster:
+            logging.error(f"Skipping {db_file}, not a per volume metrics db")
+            continue
+        if args.outputfile:  # pyright: ignore[reportAttributeAccessIssue]
+            output_file = pathlib.Path(
+                args.outputfile  # pyright: ignore[reportAttributeAccessIssue]
+            )
+        elif match:
+            output_file = db_file.with_name(f"{match.group('date')}_wide_metrics.db")
+        else:
+            output_file = db_file.with_name(f"{db_file.stem}_wide.db")
+
+        logging.info(f"Migrating {db_file} of {cluster} to {output_file}")
+        target = WideMetricDB(config, db_name=output_file.resolve())
+        with target.bulk():
+            migrate_db(
+                MetricDB(config, db_name=db_file.resolve()),
+                target,
+                cluster,
+                load_volume_names(inventory_dir / f"{cluster}_volumes.json"),
+            )
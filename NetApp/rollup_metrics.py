@@ -0,0 +1,147 @@
+"""Aggregate the volume metrics saved by dump_cluster_metrics_dii into 5 minute,
+hourly and daily rollups and prune old raw data.
+
+Every {cluster}_{date}_metrics.db and {date}_wide_metrics.db covers the day
+before and after its date, so the rollups of every database are saved to one
+rollup database keyed by (cluster, svm, volume) instead of to each database.
+The databases are rolled up oldest date first, each volume continues from its
+last rollup bucket, so a bucket in the overlap of two databases is computed
+once. A trend over months reads one database.
+"""
+
+import logging
+import pathlib
+import re
+
+from libs.config import Config
+from libs.log import setup_logger
+from libs.metric_rollup import rollup_db
+from libs.parseargs import argp
+from libs.sqlite.metrics_db import (
+    DB_NAME_RE,
+    WideMetricDB,
+    load_volume_names,
+    open_metric_db,
+    split_table_name,
+)
+
+script_name = pathlib.Path(__file__).stem
+
+setup_logger(script_name)
+
+DATE_RE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+def db_date(db_file: pathlib.Path) -> str:
+    """Return the date in the name of a metrics database, empty if there is none."""
+    match = DATE_RE.search(db_file.name)
+    return match.group() if match else ""
+
+
+if __name__ == "__main__":
+    args = argp(
+        script_name=script_name,
+        description=(
+            "aggregate the volume metrics saved by dump_cluster_metrics_dii into"
+            " 5 minute, hourly and daily rollups and prune old raw data"
+        ),
+        parse=False,
+    )
+    args.parser.add_argument(
+        "-i",
+        "--inputfile",
+        type=str,
+        help="metrics db file, default: every *_metrics.db in the db directory",
+        default="",
+    )
+    args.parser.add_argument(
+        "--db_dir",
+        type=str,
+        help=(
+            "the directory with the metrics databases,"
+            " default: the db directory of dump_cluster_metrics_dii"
+        ),
+        default="",
+    )
+    args.parser.add_argument(
+        "--inventory_dir",
+        type=str,
+        help=(
+            "the directory with the {cluster}_volumes.json inventories,"
+            " default: the data directory of dump_cluster_metrics_dii"
+        ),
+        default="",
+    )
+    args.parser.add_argument(
+        "--rollup_db",
+        type=str,
+        help="the database the rollups are saved to, default: rollup_metrics.db",
+        default="rollup_metrics.db",
+    )
+    args.parser.add_argument(
+        "-r",
+        "--retention_days",
+        type=float,
+        help="days of raw 60s data to keep, default 0 keeps everything",
+        default=0,
+    )
+
+    args.parse()
+
+    config = Config(
+        args.config_dir,  # pyright: ignore[reportAttributeAccessIssue]
+        args.output_dir,  # pyright: ignore[reportAttributeAccessIssue]
+        script_name=script_name,
+        args=args,
+    )
+
+    dump_dir = config.data_dir.parent / "dump_cluster_metrics_dii"
+    target = WideMetricDB(
+        config, db_name=args.rollup_db  # pyright: ignore[reportAttributeAccessIssue]
+    )
+
+    if args.inputfile:  # pyright: ignore[reportAttributeAccessIssue]
+        db_files = [
+            pathlib.Path(args.inputfile)  # pyright: ignore[reportAttributeAccessIssue]
+        ]
+    else:
+        db_dir = pathlib.Path(
+            args.db_dir  # pyright: ignore[reportAttributeAccessIssue]
+            or dump_dir / "db"
+        )
+        db_files = sorted(
+            (
+                db_file
+                for db_file in db_dir.glob("*_metrics.db")
+                if db_file.resolve() != pathlib.Path(target.db_location).resolve()
+            ),
+            key=lambda db_file: (db_date(db_file), db_file.name),
+        )
+        if not db_files:
+            logging.warning(f"No metrics databases in {db_dir}")
+    inventory_dir = pathlib.Path(
+        args.inventory_dir or dump_dir  # pyright: ignore[reportAttributeAccessIssue]
+    )
+
+    for db_file in db_files:
+        metrics_db = open_metric_db(config, db_file.resolve())
+        target_key = None
+        if not isinstance(metrics_db, WideMetricDB):
+            # the tables are named "{vserver}-{volume}", the cluster is in the file name
+            match = DB_NAME_RE.fullmatch(db_file.name)
+            if not match:
+                logging.error(f"Skipping {db_file}, the cluster is not in its name")
+                continue
+            cluster = match.group("cluster")
+            volume_names = load_volume_names(inventory_dir / f"{cluster}_volumes.json")
+
+            def target_key(key, cluster=cluster, volume_names=volume_names):
+                return (cluster, *split_table_name(key, volume_names))
+
+        logging.info(f"Rolling up {db_file} into {target.db_location}")
+        rollup_db(
+            metrics_db,
+            retention_days=args.retention_days,  # pyright: ignore[reportAttributeAccessIssue]
+            target=target,
+            target_key=target_key,
+        )
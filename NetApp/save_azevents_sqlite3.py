@@ -31,6 +31,8 @@ class AppClass:
         self.cluster_data = {}
         self.dt_now = datetime.now()
         self.maint_db = AzEventsDB(config=self.config)
+        # warns if a lookup would scan the whole table
+        self.maint_db.check_query_plans()
 
         self.build_app()
 
@@ -44,7 +46,9 @@ class AppClass:
         for cluster in self.cluster_data.values():
             try:
                 cluster.gather_data()
-                cluster.process_data()
+                # one transaction for the events of a cluster
+                with self.maint_db.bulk():
+                    cluster.process_data()
             except netapp_ontap.error.NetAppRestError:
                 logging.error(f"{cluster.name} : Could not connect to API")
 
@@ -121,8 +125,7 @@ class ClusterData:
             config=self.app_instance.config, db_name=db_name, overwrite=False
         )
         if not emsdb.exists:
-            for emsevent in self.fetched_data["ems_events"]:
-                emsdb.insert_event(emsevent)
+            emsdb.insert_many(self.fetched_data["ems_events"])
             emsdb.conn.close()
             logging.error(f"All events saved to {db_name}")
         else:
@@ -365,12 +368,12 @@ class ClusterData:
                 logging.error(f"last ems event was {emsevent}")
 
     def process_data(self):
+        self.app_instance.maint_db.upsert_many(self.fetched_data["azmaints"].values())
         for azevent in self.fetched_data["azmaints"].values():
             logging.info(
-                f"Cluster {self.name} adding {azevent['event_id']} "
+                f"Cluster {self.name} added {azevent['event_id']} "
                 f"for node {azevent['node']}"
             )
-            self.app_instance.maint_db.upsert_event(azevent)
 
             if azevent["event_id"] == "Unknown":
                 db_name = (
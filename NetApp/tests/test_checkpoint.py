@@ -0,0 +1,35 @@
+"""Tests for libs.checkpoint."""
+
+import json
+
+from libs.checkpoint import Checkpoint
+
+
+def test_resume(tmp_path):
+    path = tmp_path / "checkpoint.json"
+    checkpoint = Checkpoint(path)
+    checkpoint.mark_done("svm1/vol1")
+    checkpoint.mark_done("svm1/vol2")
+    checkpoint.mark_done("svm1/vol1")
+    assert path.read_text().splitlines() == ['"svm1/vol1"', '"svm1/vol2"']
+
+    resumed = Checkpoint(path)
+    assert resumed.is_done("svm1/vol1") and resumed.is_done("svm1/vol2")
+    assert not Checkpoint(path, resume=False).is_done("svm1/vol1")
+    assert not path.exists()
+
+
+def test_partial_line_is_skipped_and_compacted(tmp_path):
+    path = tmp_path / "checkpoint.json"
+    path.write_text('"svm1/vol1"\n"svm1/vol1"\n"svm1/vo')
+    checkpoint = Checkpoint(path)
+    assert checkpoint.done == {"svm1/vol1"}
+    checkpoint.mark_done("svm1/vol2")
+    assert path.read_text().splitlines() == ['"svm1/vol1"', '"svm1/vol2"']
+
+
+def test_old_format(tmp_path):
+    path = tmp_path / "checkpoint.json"
+    path.write_text(json.dumps({"done": ["svm1/vol1", "svm1/vol2"]}))
+    assert Checkpoint(path).done == {"svm1/vol1", "svm1/vol2"}
+    assert path.read_text().splitlines() == ['"svm1/vol1"', '"svm1/vol2"']
@@ -0,0 +1,94 @@
+"""Tests for libs.openapi."""
+
+import json
+
+import pytest
+
+from libs.openapi import APIWrapper
+
+# A and B reference each other
+CYCLIC_SPEC = {
+    "openapi": "3.0.0",
+    "paths": {
+        path: {
+            "post": {
+                "requestBody": {
+                    "content": {
+                        "application/json": {
+                            "schema": {"$ref": f"#/components/schemas/{name}"}
+                        }
+                    }
+                }
+            }
+        }
+        for path, name in (("/a", "A"), ("/b", "B"))
+    },
+    "components": {
+        "schemas": {
+            "A": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "b": {"$ref": "#/components/schemas/B"},
+                },
+            },
+            "B": {
+                "type": "object",
+                "properties": {
+                    "size": {"type": "integer"},
+                    "a": {"$ref": "#/components/schemas/A"},
+                },
+            },
+        }
+    },
+}
+
+
+@pytest.mark.parametrize("paths", [["/a", "/b"], ["/b", "/a"]])
+def test_cyclic_refs_validate_nested_body(tmp_path, paths):
+    """A nested invalid body is rejected whatever operation is compiled first."""
+    spec = dict(CYCLIC_SPEC, paths={p: CYCLIC_SPEC["paths"][p] for p in paths})
+    spec_file = tmp_path / "spec.json"
+    spec_file.write_text(json.dumps(spec))
+    client = APIWrapper(str(spec_file), "http://localhost", base_api_path="/api")
+
+    assert not client.validate_body("/a", "POST", {"name": "n", "b": {"size": "x"}})
+    assert client.validate_body("/a", "POST", {"name": "n", "b": {"size": 1}})
+    assert not client.validate_body("/b", "POST", {"size": 1, "a": {"name": 1}})
+    assert client.validate_body("/b", "POST", {"size": 1, "a": {"name": "n"}})
+
+
+@pytest.fixture
+def cyclic_client(tmp_path):
+    spec_file = tmp_path / "spec.json"
+    spec_file.write_text(json.dumps(CYCLIC_SPEC))
+    return APIWrapper(
+        str(spec_file),
+        "http://localhost",
+        base_api_path="/api",
+        spec_cache_dir=tmp_path / "cache",
+    )
+
+
+def test_cyclic_refs_validate_deep_body(cyclic_client):
+    """The $refs are followed as deep as the body goes."""
+    assert not cyclic_client.validate_body("/a", "POST", {"b": {"a": {"name": 1}}})
+    assert not cyclic_client.validate_body(
+        "/a", "POST", {"b": {"a": {"b": {"size": "x"}}}}
+    )
+    assert cyclic_client.validate_body(
+        "/a", "POST", {"b": {"a": {"b": {"size": 1, "a": {"name": "n"}}}}}
+    )
+
+
+def test_cyclic_refs_describe(cyclic_client):
+    """The readable schema stops at the $ref back to A."""
+    schema = cyclic_client.get_request_schema_for_endpoint(
+        "/a", "POST", human_readable=False
+    )
+    assert schema["properties"]["b"]["properties"]["a"] == {
+        "$ref": "#/components/schemas/A"
+    }
+    described = cyclic_client.get_request_schema_for_endpoint("/a", "POST")
+    assert described["fields"]["b"]["type"] == "object"
+    assert described["sample"]["b"] == {"size": 0, "a": "<a>"}
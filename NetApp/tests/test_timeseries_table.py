@@ -0,0 +1,48 @@
+"""Tests for libs.timeseries_table."""
+
+import math
+
+import pytest
+
+from libs.timeseries_table import TimeseriesTable, tables_by_tags
+
+METRICS = ["read_ops", "write_ops", "total_ops"]
+
+
+def test_empty_metrics_are_gaps():
+    results = {
+        "read_ops": [
+            {"timeseries": [{"time": 0, "value": 1}, {"time": 120000, "value": 3}]}
+        ],
+        # the metric has no data
+        "write_ops": [],
+    }
+    table = TimeseriesTable.from_results(results, METRICS).reindex(60, 0, 180)
+
+    assert table.timestamps.tolist() == [0, 60, 120]
+    assert table.columns["read_ops"][[0, 2]].tolist() == [1.0, 3.0]
+    assert math.isnan(table.columns["read_ops"][1])
+    assert table.missing()[:, 1:].all()
+    assert [(gap["metric"], gap["count"]) for gap in table.find_gaps()] == [
+        ("read_ops", 1),
+        ("write_ops", 3),
+        ("total_ops", 3),
+    ]
+
+
+def test_failed_metrics_raise():
+    results = {
+        "read_ops": [
+            {
+                "tagSet": {"vserver_name": "svm1", "volume_name": "vol1"},
+                "timeseries": [{"time": 0, "value": 1}],
+            }
+        ],
+        # the query of the metric failed
+        "write_ops": None,
+        "total_ops": [],
+    }
+    with pytest.raises(ValueError, match="write_ops"):
+        TimeseriesTable.from_results(results, METRICS)
+    with pytest.raises(ValueError, match="write_ops"):
+        tables_by_tags(results, ("vserver_name", "volume_name"), METRICS)